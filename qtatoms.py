@@ -8,7 +8,8 @@ serves as an example of how to write custom type classes.
 
 
 import struct
-from qtfile import Atom, read_struct, QuickTimeParseError
+import cStringIO
+from qtfile import Atom, read_struct, read_table, write_table, QuickTimeParseError
 
 
 class ContainerAtom(Atom):
@@ -16,7 +17,7 @@ class ContainerAtom(Atom):
 	supported_types = ["aaid", "akid", "\xa9alb", "apid", "aART", "\xa9ART", "atid", "clip",
 	    			   "\xa9cmt", "\xa9com", "covr", "cpil", "cprt", "\xa9day", "dinf", "disk",
 	    			   "edts", "geid", "gnre", "\xa9grp", "hinf", "hnti", "matt",
-	    			   "mdia", "minf", "moof", "moov", "\xa9nam", "pinf", "plid", "rtng",
+	    			   "mdia", "mfra", "minf", "moof", "moov", "mvex", "\xa9nam", "pinf", "plid", "rtng",
 	    			   "schi", "sinf", "stbl", "stik", "tmpo", "\xa9too", "traf", "trak", "trkn",
 	    			   "\xa9wrt",
 					  ]
@@ -47,8 +48,8 @@ class FileTypeAtom(Atom):
 			self.fields["compatible_brands"].append(read_struct(stream, ">4s"))
 
 	@property
-	def size(self):
-		return super(FileTypeAtom, self).size + struct.calcsize(">4s") * len(self.fields["compatible_brands"])
+	def data_size(self):
+		return super(FileTypeAtom, self).data_size + struct.calcsize(">4s") * len(self.fields["compatible_brands"])
 
 	def write_data(self, stream, recursive):
 		super(FileTypeAtom, self).write_data(stream, recursive)
@@ -121,10 +122,12 @@ class UserDataAtom(ContainerAtom):
 	trailing_null = True
 
 
-class SampleToChunkAtom(Atom):
+class TableAtom(Atom):
+	"""Base class for atoms with a table of rows following the fields, such as
+	the sample tables. Subclasses set the supported types and the format of
+	each row."""
 
-	supported_types = ["stsc"]
-	table_row_format = ">III"
+	table_row_format = ">I"
 
 	field_defs = [("version", ">c"),
 	              ("flags", ">3s"),
@@ -133,49 +136,453 @@ class SampleToChunkAtom(Atom):
 
 	def read_data(self, stream, end = None):
 		"""Parse atom data."""
-		super(SampleToChunkAtom, self).read_data(stream, end)
-		self.fields["table"] = []
-		while stream.tell() < end:
-			self.fields["table"].append(read_struct(stream, self.table_row_format))
+		super(TableAtom, self).read_data(stream, end)
+		self.fields["table"] = read_table(stream, self.table_row_format, end)
 
 	def write_data(self, stream, recursive):
-		super(SampleToChunkAtom, self).write_data(stream, recursive)
-		for v in self.fields["table"]:
-			stream.write(struct.pack(self.table_row_format, *v))
+		super(TableAtom, self).write_data(stream, recursive)
+		write_table(stream, self.table_row_format, self.fields["table"])
 
 	@property
-	def size(self):
-		return super(SampleToChunkAtom, self).size + struct.calcsize(self.table_row_format) * len(self.fields["table"])
+	def data_size(self):
+		return super(TableAtom, self).data_size + struct.calcsize(self.table_row_format) * len(self.fields["table"])
+
+	def header_fields(self):
+		"""Returns the fields before the table. Unlike the fields property, this
+		doesn't decode the table if the atom hasn't been decoded yet."""
+		if self._raw is None:
+			return dict([(key, self.fields[key]) for key, _ in self.field_defs])
+
+		fields = {}
+		offset = 0
+		for key, format in self.field_defs:
+			try:
+				fields[key] = struct.unpack_from(format, self._raw, offset)[0]
+			except struct.error, e:
+				raise QuickTimeParseError("Could not decode %s: %s" % (self.safe_kind, e), offset)
+			offset += struct.calcsize(format)
+		return fields
+
+	def packed_table(self):
+		"""Returns the rows of the table packed with table_row_format. If the atom
+		hasn't been decoded yet, this is a buffer of its raw data, so the table
+		isn't unpacked. Raises QuickTimeParseError if the raw data doesn't contain
+		a whole number of rows."""
+		if self._raw is None:
+			stream = cStringIO.StringIO()
+			write_table(stream, self.table_row_format, self.fields["table"])
+			return stream.getvalue()
+
+		offset = sum([struct.calcsize(format) for _, format in self.field_defs])
+		row_size = struct.calcsize(self.table_row_format)
+		if len(self._raw) < offset or (len(self._raw) - offset) % row_size:
+			raise QuickTimeParseError("Expected rows of %d bytes, got %d bytes" % (row_size, max(len(self._raw) - offset, 0)), offset)
+		return buffer(self._raw, offset)
+
+	def row_count(self):
+		"""Returns the number of rows in the table, without decoding it. Raises
+		QuickTimeParseError like packed_table()."""
+		if self._raw is None:
+			return len(self.fields["table"])
+		return len(self.packed_table()) // struct.calcsize(self.table_row_format)
+
+
+class SampleToChunkAtom(TableAtom):
 
+	supported_types = ["stsc"]
+	table_row_format = ">III"
 
-class ChunkOffsetAtom(Atom):
 
+class ChunkOffsetAtom(TableAtom):
 
-	# FIXME: Make this support the 64-bit variant ('co64') too.
-	
 	supported_types = ["stco"]
 	table_row_format = ">I"
 
+
+class ChunkOffset64Atom(ChunkOffsetAtom):
+
+	supported_types = ["co64"]
+	table_row_format = ">Q"
+
+
+class SampleSizeAtom(TableAtom):
+
+	supported_types = ["stsz"]
+	table_row_format = ">I"
+
+	# The table is empty if all samples have the same size.
 	field_defs = [("version", ">c"),
 	              ("flags", ">3s"),
+	              ("sample_size", ">I"),
 	              ("num_table_entries", ">I"),
 				 ]
 
+	@property
+	def sample_sizes(self):
+		"""Returns the size of each sample."""
+		if self.fields["sample_size"]:
+			return [self.fields["sample_size"]] * self.fields["num_table_entries"]
+		return self.fields["table"]
+
+
+class TimeToSampleAtom(TableAtom):
+
+	# Rows are (sample count, sample duration).
+	supported_types = ["stts"]
+	table_row_format = ">II"
+
+
+class SyncSampleAtom(TableAtom):
+
+	# Rows are sample numbers, starting at 1.
+	supported_types = ["stss"]
+	table_row_format = ">I"
+
+
+class CompositionOffsetAtom(TableAtom):
+
+	# Rows are (sample count, composition offset).
+	supported_types = ["ctts"]
+	table_row_format = ">Ii"
+
+
+class TrackReferenceTypeAtom(Atom):
+
+	# These atoms use the type field for the kind of reference (such as "tmcd" or "chap"),
+	# so this class responds to all types and should never be part of module-level registration.
+
+	explicit_registration = True
+
 	def read_data(self, stream, end = None):
 		"""Parse atom data."""
-		super(ChunkOffsetAtom, self).read_data(stream, end)
-		self.fields["table"] = []
-		while stream.tell() < end:
-			self.fields["table"].append(read_struct(stream, self.table_row_format))
+		super(TrackReferenceTypeAtom, self).read_data(stream, end)
+		self.fields["track_ids"] = read_table(stream, ">I", end)
+
+	def write_data(self, stream, recursive):
+		super(TrackReferenceTypeAtom, self).write_data(stream, recursive)
+		write_table(stream, ">I", self.fields["track_ids"])
+
+	@property
+	def data_size(self):
+		return super(TrackReferenceTypeAtom, self).data_size + struct.calcsize(">I") * len(self.fields["track_ids"])
+
+
+class TrackReferenceAtom(ContainerAtom):
+
+	# All children in this container are references to other tracks, by track ID.
+
+	supported_types = ["tref"]
+	force_child_class = TrackReferenceTypeAtom
+
+
+class TrackHeaderAtom(Atom):
+
+	supported_types = ["tkhd"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+				 ]
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(TrackHeaderAtom, self).read_data(stream, end)
+		self.fields["creation_time"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["modification_time"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["track_id"] = read_struct(stream, ">I")
+		self.fields["reserved"] = read_struct(stream, ">4s")
+		self.fields["duration"] = read_struct(stream, time_format(self.fields["version"]))
+
+		# Layer, volume, matrix and dimensions are kept as they are.
+		self.fields["properties"] = stream.read(end - stream.tell())
+
+	def write_data(self, stream, recursive):
+		super(TrackHeaderAtom, self).write_data(stream, recursive)
+		format = time_format(self.fields["version"])
+		stream.write(struct.pack(format, self.fields["creation_time"]))
+		stream.write(struct.pack(format, self.fields["modification_time"]))
+		stream.write(struct.pack(">I", self.fields["track_id"]))
+		stream.write(struct.pack(">4s", self.fields["reserved"]))
+		stream.write(struct.pack(format, self.fields["duration"]))
+		stream.write(self.fields["properties"])
+
+	@property
+	def data_size(self):
+		return super(TrackHeaderAtom, self).data_size + struct.calcsize(time_format(self.fields["version"])) * 3 + \
+			struct.calcsize(">I4s") + len(self.fields["properties"])
+
+
+class MediaHeaderAtom(Atom):
+
+	supported_types = ["mdhd"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+				 ]
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(MediaHeaderAtom, self).read_data(stream, end)
+		self.fields["creation_time"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["modification_time"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["timescale"] = read_struct(stream, ">I")
+		self.fields["duration"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["language"] = read_struct(stream, ">H")
+		self.fields["quality"] = read_struct(stream, ">H")
+
+	def write_data(self, stream, recursive):
+		super(MediaHeaderAtom, self).write_data(stream, recursive)
+		format = time_format(self.fields["version"])
+		stream.write(struct.pack(format, self.fields["creation_time"]))
+		stream.write(struct.pack(format, self.fields["modification_time"]))
+		stream.write(struct.pack(">I", self.fields["timescale"]))
+		stream.write(struct.pack(format, self.fields["duration"]))
+		stream.write(struct.pack(">HH", self.fields["language"], self.fields["quality"]))
+
+	@property
+	def data_size(self):
+		return super(MediaHeaderAtom, self).data_size + struct.calcsize(time_format(self.fields["version"])) * 3 + \
+			struct.calcsize(">IHH")
+
+
+class TrackExtendsAtom(Atom):
+
+	supported_types = ["trex"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("track_id", ">I"),
+	              ("default_sample_description_index", ">I"),
+	              ("default_sample_duration", ">I"),
+	              ("default_sample_size", ">I"),
+	              ("default_sample_flags", ">I"),
+				 ]
+
+
+class MovieFragmentHeaderAtom(Atom):
+
+	supported_types = ["mfhd"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("sequence_number", ">I"),
+				 ]
+
+
+class OptionalFieldsAtom(Atom):
+	"""Base class for atoms where the flags indicate which of the optional
+	fields are present. The optional fields follow the regular fields."""
+
+	# List of (flag, key, format).
+	optional_field_defs = []
+
+	def present_fields(self):
+		"""Returns (key, format) for the optional fields indicated by the flags."""
+		flags = unpack_flags(self.fields["flags"])
+		return [(key, format) for flag, key, format in self.optional_field_defs if flags & flag]
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(OptionalFieldsAtom, self).read_data(stream, end)
+		for key, format in self.present_fields():
+			self.fields[key] = read_struct(stream, format)
+
+	def write_data(self, stream, recursive):
+		super(OptionalFieldsAtom, self).write_data(stream, recursive)
+		for key, format in self.present_fields():
+			stream.write(struct.pack(format, self.fields[key]))
+
+	@property
+	def data_size(self):
+		return super(OptionalFieldsAtom, self).data_size + \
+			sum([struct.calcsize(format) for _, format in self.present_fields()])
+
+
+class TrackFragmentHeaderAtom(OptionalFieldsAtom):
+
+	supported_types = ["tfhd"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("track_id", ">I"),
+				 ]
+
+	optional_field_defs = [(0x000001, "base_data_offset", ">Q"),
+	                       (0x000002, "sample_description_index", ">I"),
+	                       (0x000008, "default_sample_duration", ">I"),
+	                       (0x000010, "default_sample_size", ">I"),
+	                       (0x000020, "default_sample_flags", ">I"),
+	                      ]
+
+	# Set in the flags to make data offsets relative to the start of the "moof" atom.
+	default_base_is_moof = 0x020000
+
+
+class TrackFragmentDecodeTimeAtom(Atom):
+
+	supported_types = ["tfdt"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+				 ]
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(TrackFragmentDecodeTimeAtom, self).read_data(stream, end)
+		self.fields["base_media_decode_time"] = read_struct(stream, time_format(self.fields["version"]))
+
+	def write_data(self, stream, recursive):
+		super(TrackFragmentDecodeTimeAtom, self).write_data(stream, recursive)
+		stream.write(struct.pack(time_format(self.fields["version"]), self.fields["base_media_decode_time"]))
+
+	@property
+	def data_size(self):
+		return super(TrackFragmentDecodeTimeAtom, self).data_size + struct.calcsize(time_format(self.fields["version"]))
+
+
+class TrackRunAtom(OptionalFieldsAtom):
+
+	supported_types = ["trun"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("sample_count", ">I"),
+				 ]
+
+	optional_field_defs = [(0x000001, "data_offset", ">i"),
+	                       (0x000004, "first_sample_flags", ">I"),
+	                      ]
+
+	# List of (flag, key, format) for the fields of each sample. The composition
+	# offsets are signed in version 1 of this atom.
+	sample_field_defs = [(0x000100, "duration", "I"),
+	                     (0x000200, "size", "I"),
+	                     (0x000400, "flags", "I"),
+	                     (0x000800, "composition_offset", "I"),
+	                    ]
+
+	@property
+	def sample_row_format(self):
+		"""Returns the format of a row in the samples table, which is a tuple of
+		the sample fields indicated by the flags."""
+		flags = unpack_flags(self.fields["flags"])
+		format = ">"
+		for flag, key, code in self.sample_field_defs:
+			if flags & flag:
+				if key == "composition_offset" and self.fields["version"] == "\x01":
+					code = "i"
+				format += code
+		return format
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(TrackRunAtom, self).read_data(stream, end)
+		if self.sample_row_format == ">":
+			self.fields["samples"] = []
+		else:
+			self.fields["samples"] = read_table(stream, self.sample_row_format, end, unwrap=False)
+
+	def write_data(self, stream, recursive):
+		super(TrackRunAtom, self).write_data(stream, recursive)
+		write_table(stream, self.sample_row_format, self.fields["samples"])
+
+	@property
+	def data_size(self):
+		return super(TrackRunAtom, self).data_size + struct.calcsize(self.sample_row_format) * len(self.fields["samples"])
+
+
+class SegmentIndexAtom(Atom):
+
+	supported_types = ["sidx"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("reference_id", ">I"),
+	              ("timescale", ">I"),
+				 ]
+
+	# Each reference is packed into three 32-bit words, which are unpacked into rows of
+	# (reference_type, referenced_size, subsegment_duration, starts_with_sap, sap_type, sap_delta_time).
+	reference_format = ">III"
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(SegmentIndexAtom, self).read_data(stream, end)
+		self.fields["earliest_presentation_time"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["first_offset"] = read_struct(stream, time_format(self.fields["version"]))
+		self.fields["reserved"], self.fields["reference_count"] = read_struct(stream, ">HH")
+		self.fields["references"] = [(a >> 31, a & 0x7fffffff, duration, c >> 31, (c >> 28) & 0x7, c & 0x0fffffff)
+		                             for a, duration, c in read_table(stream, self.reference_format, end)]
+
+	def write_data(self, stream, recursive):
+		super(SegmentIndexAtom, self).write_data(stream, recursive)
+		format = time_format(self.fields["version"])
+		stream.write(struct.pack(format, self.fields["earliest_presentation_time"]))
+		stream.write(struct.pack(format, self.fields["first_offset"]))
+		stream.write(struct.pack(">HH", self.fields["reserved"], self.fields["reference_count"]))
+		write_table(stream, self.reference_format,
+		            [(kind << 31 | size, duration, sap << 31 | sap_type << 28 | delta)
+		             for kind, size, duration, sap, sap_type, delta in self.fields["references"]])
+
+	@property
+	def data_size(self):
+		return super(SegmentIndexAtom, self).data_size + struct.calcsize(time_format(self.fields["version"])) * 2 + \
+			struct.calcsize(">HH") + struct.calcsize(self.reference_format) * len(self.fields["references"])
+
+
+class TrackFragmentRandomAccessAtom(Atom):
+
+	supported_types = ["tfra"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("track_id", ">I"),
+	              ("length_sizes", ">I"),
+	              ("number_of_entries", ">I"),
+				 ]
+
+	# Formats of the traf, trun and sample numbers, by their size in bytes.
+	number_formats = {1: ">B", 2: ">H", 4: ">I"}
+
+	@property
+	def entry_formats(self):
+		"""Returns the formats of the fields in each entry, which are (time, moof_offset,
+		traf_number, trun_number, sample_number)."""
+		format = time_format(self.fields["version"])
+		sizes = [((self.fields["length_sizes"] >> shift) & 0x3) + 1 for shift in (4, 2, 0)]
+		for size in sizes:
+			if size not in self.number_formats:
+				raise QuickTimeParseError("Unsupported %d-byte field in random access entries" % size)
+		return [format, format] + [self.number_formats[size] for size in sizes]
+
+	def read_data(self, stream, end = None):
+		"""Parse atom data."""
+		super(TrackFragmentRandomAccessAtom, self).read_data(stream, end)
+		formats = self.entry_formats
+		self.fields["entries"] = []
+		for _ in range(self.fields["number_of_entries"]):
+			self.fields["entries"].append(tuple([read_struct(stream, format) for format in formats]))
 
 	def write_data(self, stream, recursive):
-		super(ChunkOffsetAtom, self).write_data(stream, recursive)
-		for v in self.fields["table"]:
-			stream.write(struct.pack(">I", v))
+		super(TrackFragmentRandomAccessAtom, self).write_data(stream, recursive)
+		formats = self.entry_formats
+		for entry in self.fields["entries"]:
+			for format, value in zip(formats, entry):
+				stream.write(struct.pack(format, value))
 
 	@property
-	def size(self):
-		return super(ChunkOffsetAtom, self).size + struct.calcsize(self.table_row_format) * len(self.fields["table"])
+	def data_size(self):
+		return super(TrackFragmentRandomAccessAtom, self).data_size + \
+			sum([struct.calcsize(format) for format in self.entry_formats]) * len(self.fields["entries"])
+
+
+class MovieFragmentRandomAccessOffsetAtom(Atom):
+
+	supported_types = ["mfro"]
+
+	field_defs = [("version", ">c"),
+	              ("flags", ">3s"),
+	              ("size", ">I"),
+				 ]
 
 
 class ColorParametersAtom(Atom):
@@ -218,14 +625,26 @@ class MetadataHandlerAtom(Atom):
 		stream.write(self.fields["name"])
 
 	@property
-	def size(self):
-		return super(MetadataHandlerAtom, self).size + len(self.fields["name"]) + struct.calcsize(self.reserved_format) * self.reserved_count
+	def data_size(self):
+		return super(MetadataHandlerAtom, self).data_size + len(self.fields["name"]) + struct.calcsize(self.reserved_format) * self.reserved_count
 
 
 class MetadataAtom(ContainerAtom):
 
 	supported_types = ["meta"]
 
+	def __init__(self, kind=""):
+		super(MetadataAtom, self).__init__(kind)
+		self._metadata = None
+
+	def metadata(self, refresh=False):
+		"""Returns a MetadataView of the keys and values in this atom. The view is
+		built on first use and then cached, so changes made directly to the "keys"
+		and "ilst" atoms will not show up unless refresh is set."""
+		if self._metadata is None or refresh:
+			self._metadata = MetadataView(self)
+		return self._metadata
+
 
 class MetadataKeysAtom(Atom):
 
@@ -258,17 +677,13 @@ class MetadataKeysAtom(Atom):
 			stream.write(value)
 
 	@property
-	def size(self):
-		return super(MetadataKeysAtom, self).size + \
+	def data_size(self):
+		return super(MetadataKeysAtom, self).data_size + \
 			sum([struct.calcsize(self.key_header_format) + len(v[1]) for v in self.fields["keys"]])
 
 	def find_metadata_value(self, namespace, key):
 		"""Find the value for a metadata key in the related atom structure."""
-		index = self.fields["keys"].index((namespace, key))
-		for ilst in self.parent.find("ilst"):
-			for data in ilst[index].find("data"):
-				return data["value"]
-		return None
+		return self.parent.metadata().get((namespace, key))
 
 
 class MetadataItemAtom(ContainerAtom):
@@ -306,10 +721,10 @@ class DataAtom(Atom):
 	              ("locale", ">I")]
 
 	type_handlers = {1: (lambda d: unicode(d, 'utf8'),
-						 lambda d: d,
+						 lambda d: d.encode('utf8') if isinstance(d, unicode) else d,
 						 None),
-					 2: (lambda d: unicode(d, 'utf16'),
-					   	 lambda d: d,
+					 2: (lambda d: unicode(d, 'utf16' if d[:2] in ('\xfe\xff', '\xff\xfe') else 'utf-16-be'),
+					   	 lambda d: (d if isinstance(d, unicode) else unicode(d, 'utf8')).encode('utf-16-be'),
 					   	 None),
 					 21: (lambda d: struct.unpack(">i", d)[0],
 					      lambda d: struct.pack(">i", d),
@@ -343,10 +758,188 @@ class DataAtom(Atom):
 			stream.write(data)
 
 	@property
-	def size(self):
-		_, _, size = self.type_handlers.get(self.fields["type"], (None, None, None))
+	def data_size(self):
+		_, encoder, size = self.type_handlers.get(self.fields["type"], (None, None, None))
 		if size:
-			return super(DataAtom, self).size + size
+			return super(DataAtom, self).data_size + size
+		elif encoder:
+			return super(DataAtom, self).data_size + len(encoder(self.fields["value"]))
 		else:
-			return super(DataAtom, self).size + len(self.fields["value"])
+			return super(DataAtom, self).data_size + len(self.fields["value"])
+
+	@classmethod
+	def type_for_value(cls, value):
+		"""Returns a suitable data type for a Python value."""
+		if isinstance(value, (int, long)):
+			return 21
+		elif isinstance(value, float):
+			return 23
+		else:
+			return 1
+
+
+class MetadataView(object):
+	"""Dict-like view of the metadata in a "meta" atom, where the keys are
+	(namespace, key) tuples.
+
+	The view is built with a single pass over the "keys" and "ilst" atoms,
+	and keeps both of them consistent when values are set or deleted. Items
+	in "ilst" are matched to keys by the index stored in their type.
+	"""
+
+	def __init__(self, meta):
+		self.meta = meta
+		self.keys_atom = None
+		self.items_atom = None
+
+		# Maps (namespace, key) to a position in the keys table, and positions to item atoms.
+		self._positions = {}
+		self._items = {}
+
+		for child in meta:
+			if child.kind == "keys" and self.keys_atom is None:
+				self.keys_atom = child
+			elif child.kind == "ilst" and self.items_atom is None:
+				self.items_atom = child
+
+		if self.keys_atom is not None:
+			for position, key in enumerate(self.keys_atom["keys"]):
+				self._positions.setdefault(key, position)
+
+		if self.items_atom is not None:
+			for item in self.items_atom:
+				self._items[struct.unpack(">I", item.kind)[0] - 1] = item
+
+	def __len__(self):
+		return len(self._positions)
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __contains__(self, key):
+		return key in self._positions
+
+	def __getitem__(self, key):
+		item = self._items.get(self._positions[key])
+		if item is not None:
+			for data in item.find("data", recursive=False):
+				return data["value"]
+		return None
 
+	def __setitem__(self, key, value):
+		self.update({key: value})
+
+	def __delitem__(self, key):
+		if key not in self._positions:
+			raise KeyError(key)
+		self.delete([key])
+
+	def get(self, key, default=None):
+		if key in self._positions:
+			return self[key]
+		return default
+
+	def keys(self):
+		"""Returns all (namespace, key) tuples, in the order they are stored."""
+		return sorted(self._positions, key=self._positions.get)
+
+	def items(self):
+		"""Returns all ((namespace, key), value) tuples, in the order they are stored."""
+		return [(key, self[key]) for key in self.keys()]
+
+	def update(self, values):
+		"""Set the values for multiple keys. New keys are appended to the key table."""
+		for key, value in values.items():
+			position = self._positions.get(key)
+			if position is None:
+				position = self._add_key(key)
+
+			item = self._items.get(position)
+			if item is None:
+				self._add_item(position, value)
+				continue
+
+			for data in item.find("data", recursive=False):
+				if DataAtom.type_for_value(data["value"]) != DataAtom.type_for_value(value):
+					data["type"] = DataAtom.type_for_value(value)
+				data["value"] = value
+				break
+			else:
+				item.append(self._make_data(item, value))
+
+	def delete(self, keys):
+		"""Delete multiple keys and their values, renumbering the remaining items."""
+		removed = set([self._positions[key] for key in keys if key in self._positions])
+		if not removed:
+			return
+
+		table = []
+		renumbered = {}
+		for position, key in enumerate(self.keys_atom["keys"]):
+			if position not in removed:
+				renumbered[position] = len(table)
+				table.append(key)
+
+		self.keys_atom["keys"] = table
+		self.keys_atom["entry_count"] = len(table)
+
+		items = {}
+		for position, item in self._items.items():
+			if position in renumbered:
+				item.kind = struct.pack(">I", renumbered[position] + 1)
+				items[renumbered[position]] = item
+
+		if self.items_atom is not None:
+			self.items_atom[:] = [items[position] for position in sorted(items)]
+		self._items = items
+		self._positions = {}
+		for position, key in enumerate(table):
+			self._positions.setdefault(key, position)
+
+	def _add_key(self, key):
+		if self.keys_atom is None:
+			self.keys_atom = MetadataKeysAtom("keys")
+			self.keys_atom.fields.update(version="\x00", flags="\x00" * 3, entry_count=0, keys=[])
+			self.keys_atom.parent = self.meta
+			self.meta.append(self.keys_atom)
+
+		position = len(self.keys_atom["keys"])
+		self.keys_atom["keys"].append(key)
+		self.keys_atom["entry_count"] = len(self.keys_atom["keys"])
+		self._positions[key] = position
+		return position
+
+	def _add_item(self, position, value):
+		if self.items_atom is None:
+			self.items_atom = MetadataItemListAtom("ilst")
+			self.items_atom.parent = self.meta
+			self.meta.append(self.items_atom)
+
+		item = MetadataItemAtom(struct.pack(">I", position + 1))
+		item.parent = self.items_atom
+		item.append(self._make_data(item, value))
+		self.items_atom.append(item)
+		self._items[position] = item
+
+	def _make_data(self, item, value):
+		data = DataAtom("data")
+		data.parent = item
+		data.fields.update(type=DataAtom.type_for_value(value), locale=0, value=value)
+		return data
+
+
+def time_format(version):
+	"""Returns the format of times and durations, which are 64-bit in version 1 atoms."""
+	if version == "\x01":
+		return ">Q"
+	return ">I"
+
+
+def unpack_flags(flags):
+	"""Returns the 24-bit flags field of an atom as an integer."""
+	return struct.unpack(">I", "\x00" + flags)[0]
+
+
+def pack_flags(flags):
+	"""Returns an integer as a 24-bit flags field."""
+	return struct.pack(">I", flags)[1:]
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import optparse
+
+import qtfile
+import qtatoms
+
+
+USAGE = """Usage: %prog [options] <old_movie> <new_movie>
+
+Compare the atom trees of two QuickTime movies, and list the atoms and fields
+that were added, removed or changed. The exit status is 1 if the movies differ.
+"""
+
+# Field values with a longer representation than this are summarized by their digest.
+MAX_FIELD_REPR = 80
+
+
+class AtomHash(object):
+	"""Content hash of an atom. The data digest covers the serialized data of the
+	atom itself, and the digest covers the type, the data digest and the digests
+	of all children, so identical subtrees can be found by comparing digests."""
+
+	def __init__(self, kind, size, data_digest, digest, fields=None, children=None):
+		self.kind = kind
+		self.size = size
+		self.data_digest = data_digest
+		self.digest = digest
+		self.fields = fields or {}
+		self.children = children or []
+
+	def __repr__(self):
+		return "<%s %s %s>" % (self.__class__.__name__, self.kind.encode("string_escape"), self.digest)
+
+	def to_dict(self):
+		return {"kind": self.kind.decode("latin-1"),
+				"size": self.size,
+				"data_digest": self.data_digest,
+				"digest": self.digest,
+				"fields": self.fields,
+				"children": [child.to_dict() for child in self.children]}
+
+	@classmethod
+	def from_dict(cls, d):
+		return cls(d["kind"].encode("latin-1"),
+				   d["size"],
+				   d["data_digest"],
+				   d["digest"],
+				   dict((str(key), str(value)) for key, value in d["fields"].items()),
+				   [cls.from_dict(child) for child in d["children"]])
+
+
+class HashStream(object):
+	"""Write-only stream that feeds everything written to a hash object."""
+
+	def __init__(self, hasher):
+		self.hasher = hasher
+		self.position = 0
+
+	def write(self, data):
+		self.hasher.update(data)
+		self.position += len(data)
+
+	def tell(self):
+		return self.position
+
+
+def hash_atoms(atoms, algorithm="sha1"):
+	"""Compute content hashes for a list of atoms (such as a QuickTimeFile) and
+	their children. Returns a list of AtomHash. Passthrough data is read from
+	the source in chunks, so the whole tree is hashed with a single pass over
+	the source without holding any payloads in memory."""
+	return [hash_atom(atom, algorithm) for atom in atoms]
+
+
+def hash_atom(atom, algorithm="sha1"):
+	"""Compute the content hash for a single atom and its children."""
+	data_hasher = hashlib.new(algorithm)
+
+	if isinstance(atom, qtfile.PassthroughAtom):
+		atom._source.seek(atom._offset)
+		remaining = atom._size
+		while remaining > 0:
+			data = atom._source.read(min(qtfile.COPY_CHUNK_SIZE, remaining))
+			if not data:
+				break
+			data_hasher.update(data)
+			remaining -= len(data)
+		children = []
+		fields = {}
+	else:
+		atom.write(HashStream(data_hasher), recursive=False)
+		children = [hash_atom(child, algorithm) for child in atom]
+		try:
+			fields = dict((key, summarize(value)) for key, value in atom.fields.items())
+		except qtfile.QuickTimeParseError, e:
+			# Atoms that can't be decoded are written unchanged, so they are still compared by their data.
+			logging.error("Could not parse %s: %s" % (atom.path.encode("string_escape"), e))
+			fields = {}
+
+	hasher = hashlib.new(algorithm)
+	hasher.update(atom.kind)
+	hasher.update(data_hasher.digest())
+	for child in children:
+		hasher.update(child.digest)
+
+	return AtomHash(atom.kind, atom.size, data_hasher.hexdigest(), hasher.hexdigest(), fields, children)
+
+
+def summarize(value):
+	"""Returns a printable representation of a field value, or a digest of it if it's long."""
+	text = repr(value)
+	if len(text) > MAX_FIELD_REPR:
+		return "<%d chars, sha1 %s>" % (len(text), hashlib.sha1(text).hexdigest()[:16])
+	return text
+
+
+def load_hashes(path, cache_dir=None, algorithm="sha1"):
+	"""Read a movie and compute its content hashes. If a cache directory is given,
+	the hashes are stored there and reused as long as the size, modification and
+	change times, device and inode of the movie are unchanged."""
+	cache_path = None
+	if cache_dir:
+		stat = os.stat(path)
+		key = "%s:%d:%r:%r:%d:%d:%s" % (os.path.abspath(path), stat.st_size, stat.st_mtime, stat.st_ctime,
+		                                stat.st_dev, stat.st_ino, algorithm)
+		cache_path = os.path.join(cache_dir, hashlib.sha1(key).hexdigest() + ".json")
+		if os.path.exists(cache_path):
+			with open(cache_path) as f:
+				return [AtomHash.from_dict(d) for d in json.load(f)]
+
+	with open(path, "rb") as stream:
+		hashes = hash_atoms(qtfile.QuickTimeFile(stream, atom_modules=[qtatoms]), algorithm)
+
+	if cache_path:
+		with open(cache_path, "w") as f:
+			json.dump([h.to_dict() for h in hashes], f)
+
+	return hashes
+
+
+def diff(old, new, path=""):
+	"""Compare two lists of AtomHash. Returns a list of differences as dicts with
+	the keys "change" ("added", "removed" or "changed"), "path" and, for changed
+	fields, "fields" mapping each field to its (old, new) values. Children are
+	matched by type and position among siblings of the same type, and subtrees
+	with identical digests are skipped without descending into them."""
+	changes = []
+	old_children = index_children(old)
+	new_children = index_children(new)
+	new_by_name = dict(new_children)
+
+	for name, a in old_children:
+		b = new_by_name.get(name)
+		child_path = path + "/" + name if path else name
+		if b is None:
+			changes.append({"change": "removed", "path": child_path})
+		elif a.digest != b.digest:
+			changes.extend(diff_atom(a, b, child_path))
+
+	old_names = set(name for name, _ in old_children)
+	for name, b in new_children:
+		if name not in old_names:
+			changes.append({"change": "added", "path": path + "/" + name if path else name})
+
+	return changes
+
+
+def diff_atom(a, b, path):
+	"""Compare two AtomHash with the same type, and their children."""
+	changes = []
+	if a.data_digest != b.data_digest:
+		fields = {}
+		for key in sorted(set(a.fields) | set(b.fields)):
+			if a.fields.get(key) != b.fields.get(key):
+				fields[key] = (a.fields.get(key), b.fields.get(key))
+
+		# Containers also change data when the size of a child changes, which isn't worth reporting.
+		if fields or not (a.children or b.children):
+			change = {"change": "changed", "path": path}
+			if fields:
+				change["fields"] = fields
+			changes.append(change)
+
+	changes.extend(diff(a.children, b.children, path))
+	return changes
+
+
+def index_children(hashes):
+	"""Returns a list of (name, AtomHash), where name is the escaped type with the
+	position among siblings of the same type appended if it's not the first."""
+	seen = {}
+	named = []
+	for h in hashes:
+		ordinal = seen.get(h.kind, 0)
+		seen[h.kind] = ordinal + 1
+		name = h.kind.encode("string_escape")
+		if ordinal:
+			name = "%s[%d]" % (name, ordinal)
+		named.append((name, h))
+	return named
+
+
+def main(argv):
+	parser = optparse.OptionParser(usage=USAGE)
+	parser.add_option("-D", "--debug", action="store_true", help="Enable debugging output")
+	parser.add_option("-C", "--cache", default=None, help="Cache atom hashes in this directory")
+	parser.add_option("-A", "--algorithm", default="sha1", help="Hash algorithm (default: sha1)")
+	parser.add_option("-J", "--json", action="store_true", default=False, help="Print differences as JSON lines")
+
+	opts, args = parser.parse_args(argv)
+	if len(args) != 3:
+		parser.error("missing mandatory arguments (need two movies to compare)")
+
+	if opts.debug:
+		logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(message)s", level=logging.DEBUG)
+	else:
+		logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(message)s", level=logging.ERROR)
+
+	old, new = [load_hashes(path, opts.cache, opts.algorithm) for path in args[1:]]
+	changes = diff(old, new)
+
+	for change in changes:
+		if opts.json:
+			print json.dumps(change, sort_keys=True)
+		else:
+			print "%-8s %s" % (change["change"], change["path"])
+			for key, (a, b) in sorted(change.get("fields", {}).items()):
+				print " | %s: %s -> %s" % (key, a, b)
+
+	if changes:
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
@@ -3,6 +3,9 @@
 
 import os
 import sys
+import json
+import base64
+import string
 import logging
 import optparse
 
@@ -13,21 +16,84 @@ import qtatoms
 USAGE = """Usage: %prog [options] <movie ...>
 
 Dump atom tree (including fields and values) from QuickTime movies.
+
+With --format jsonl, one JSON record is printed for each atom as soon as it
+has been read, with the keys "file", "offset", "size", "depth", "path", "kind"
+and "fields". Atom types and strings that aren't printable ASCII are escaped
+or base64 encoded (as {"base64": "..."}).
 """
 
+# Characters that are left as they are in JSON output. Strings with other characters are base64 encoded.
+PRINTABLE = string.digits + string.letters + string.punctuation + " \t\r\n"
+
+
+def json_value(value):
+	"""Convert a field value to something that can be represented in JSON."""
+	if isinstance(value, str):
+		if value.translate(None, PRINTABLE):
+			return {"base64": base64.b64encode(value)}
+		return value
+	elif isinstance(value, (list, tuple)):
+		return [json_value(v) for v in value]
+	elif isinstance(value, dict):
+		return dict((str(k), json_value(v)) for k, v in value.items())
+	elif value is None or isinstance(value, (unicode, bool, int, long, float)):
+		return value
+	return repr(value)
+
+
+def atom_record(atom, depth, fields=True):
+	"""Returns a JSON-safe dict describing an atom that was read from a movie."""
+	record = {"offset": atom.source_offset,
+			  "size": atom.source_size,
+			  "depth": depth,
+			  "path": atom.path.encode("string_escape"),
+			  "kind": atom.kind.encode("string_escape")}
+	if fields:
+		try:
+			record["fields"] = json_value(atom.fields)
+		except qtfile.QuickTimeParseError, e:
+			record["error"] = str(e)
+	return record
+
+
+def find_atoms(atoms, selection):
+	"""Find atoms matching an InterestSet, by type or by path."""
+	matches = []
+	for atom in atoms:
+		if selection.matches(atom.kind, atom.path):
+			matches.append(atom)
+		matches.extend(find_atoms(atom, selection))
+	return matches
+
 
 def main(argv):
 	parser = optparse.OptionParser(usage=USAGE)
 	parser.add_option("-D", "--debug", action="store_true", help="Enable debugging output")
-	parser.add_option("-T", "--types", default=None, help="Only show atoms of specific types")
+	parser.add_option("-T", "--types", default=None, help="Only show atoms of specific types or paths (such as moov/trak/mdia/hdlr)")
 	parser.add_option("-F", "--no-fields", dest="fields", action="store_false", default=True, help="Do not show atom fields and values")
 	parser.add_option("-M", "--metadata", action="store_true", default=False, help="Show related metadata key and value atoms")
+	parser.add_option("-f", "--format", choices=["tree", "jsonl"], default="tree", help="Output format, tree or jsonl (default: tree)")
+	parser.add_option("-d", "--max-depth", type="int", default=None, help="Do not parse atoms below this depth (0 for top-level atoms only)")
+	parser.add_option("-P", "--progress", type="float", default=None, metavar="SECONDS", help="Show progress and throughput on stderr at this interval")
 
 	opts, args = parser.parse_args(argv)
+	if opts.format == "jsonl" and opts.metadata:
+		parser.error("--metadata can't be used with --format jsonl")
+
 	if opts.types:
 		types = opts.types.split(",")
 	else:
 		types = []
+	selection = qtfile.InterestSet(types)
+
+	# Only parse the atoms that will be shown.
+	if opts.metadata:
+		interest = ["meta"]
+	elif types:
+		interest = types
+	else:
+		interest = None
 
 	if opts.debug:
 		logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(message)s", level=logging.DEBUG)
@@ -39,14 +105,17 @@ def main(argv):
 		indent = " "*4
 
 		for meta in qt.find("meta"):
-			keys = meta.find("keys")[0]
-			values = meta.find("ilst")[0]
-
 			print meta.parent
 			print indent + str(meta)
 
-			for namespace, key in keys['keys']:
-				print "%s%s:%s=%s" % (indent * 2, namespace, key, keys.find_metadata_value(namespace, key))
+			try:
+				metadata = meta.metadata()
+			except qtfile.QuickTimeParseError, e:
+				print "%s(parse error %s)" % (indent * 2, e)
+				continue
+
+			for (namespace, key), value in metadata.items():
+				print "%s%s:%s=%s" % (indent * 2, namespace, key, value)
 
 
 	def dump_atoms(atoms, level=0):
@@ -55,7 +124,13 @@ def main(argv):
 		for atom in atoms:
 			print indent + "%s" % (atom)
 			if opts.fields:
-				for key, value in atom.fields.items():
+				try:
+					fields = atom.fields
+				except qtfile.QuickTimeParseError, e:
+					print indent + " | (parse error %s)" % (e)
+					fields = {}
+
+				for key, value in fields.items():
 					if isinstance(value, str) or isinstance(value, unicode):
 						print indent + " | %s='%s'" % (key, value)
 					else:
@@ -64,15 +139,36 @@ def main(argv):
 			dump_atoms(atom, level+1)
 
 
+	def dump_record(atom, depth):
+		if types and not selection.matches(atom.kind, atom.path):
+			return
+		record = atom_record(atom, depth, opts.fields)
+		record["file"] = qt_path
+		sys.stdout.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+	if opts.progress is not None:
+		progress = qtfile.ProgressMonitor(lambda report: sys.stderr.write(qtfile.format_progress(report) + "\n"), opts.progress)
+	else:
+		progress = None
+
+
 	for qt_path in args[1:]:
+		if opts.format == "jsonl":
+			# Records are written while reading, so there's nothing left to dump afterwards.
+			qtfile.QuickTimeFile(qt_path, atom_modules=[qtatoms], interest=interest,
+			                     callback=dump_record, max_depth=opts.max_depth, progress=progress)
+			continue
+
 		print "[%s]" % (qt_path)
-		qt = qtfile.QuickTimeFile(qt_path, atom_modules=[qtatoms])
+		qt = qtfile.QuickTimeFile(qt_path, atom_modules=[qtatoms], interest=interest,
+		                          max_depth=opts.max_depth, progress=progress)
 
 		if opts.metadata:
 			dump_metadata(qt)
 		else:
 			if types:
-				dump_atoms(qt.find(types))
+				dump_atoms(find_atoms(qt, selection))
 			else:
 				dump_atoms(qt)
 
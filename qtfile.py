@@ -38,21 +38,35 @@ __author__ = "Niklas Aldergren <niklas@aldergren.com>"
 import logging
 import struct
 import os
+import json
+import time
+import bisect
 import string
+import hashlib
+import threading
+import itertools
+import cStringIO
 
 LOG = logging.getLogger("qtfile")
 
+# Size of the reads used when copying or hashing passthrough data.
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
 
 class QuickTimeFile(list):
 	"""A QuickTime movie."""
 
-	def __init__(self, source=None, atom_classes=None, atom_modules=None):
+	def __init__(self, source=None, atom_classes=None, atom_modules=None, interest=None,
+	             callback=None, max_depth=None, progress=None):
 		"""Initialize QuickTime movie. To directly read an existing movie, 
 		the source parameter can be either a path or a file-like object.
 
 		The atom_handlers parameter can be used to register additional
 		type-specific classes. The atom_modules has the same purpose, but
 		will find and register all appropriate classes in the given modules.
+
+		The interest, callback, max_depth and progress parameters
+		are passed on to read().
 		"""
 		if atom_classes:
 			self.atom_classes = atom_classes
@@ -65,9 +79,9 @@ class QuickTimeFile(list):
 
 		if source:
 			if isinstance(source, str):
-				self.read(open(source, 'rb'))
+				self.read(open(source, 'rb'), interest, callback, max_depth, progress)
 			else:
-				self.read(source)
+				self.read(source, interest, callback, max_depth, progress)
 
 	def register_class(self, cls):
 		"""Register an atom class."""
@@ -88,17 +102,108 @@ class QuickTimeFile(list):
 			self.register_class(cls)
 
 
-	def read(self, stream):
+	def read(self, stream, interest=None, callback=None, max_depth=None, progress=None):
 		"""Read QuickTime movie from stream. The stream argument can be
-		any file-like object that implements read(), tell() and seek()."""
+		any file-like object that implements read(), tell() and seek().
+
+		If interest is set to a list of atom types and/or paths (such as
+		"moov/trak/mdia/hdlr"), only those atoms and the containers that
+		may lead to them are parsed with the registered classes. Everything
+		else is left as passthrough atoms.
+
+		If a callback is given, it's called with each atom and its depth
+		(0 for top-level atoms) as soon as the atom has been read, before
+		its children. If max_depth is set, containers at that depth are
+		not descended into and are left as passthrough atoms.
+
+		If progress is set to a ProgressMonitor (or a function, which is
+		wrapped in one), it's updated as atoms are read."""
 		for a in self:
 			self.remove(a)
-		for a in Atom.read(stream, stream.tell(), 0, self, self.atom_classes):
+
+		if interest is not None and not isinstance(interest, InterestSet):
+			interest = InterestSet(interest)
+
+		if progress is not None:
+			if not isinstance(progress, ProgressMonitor):
+				progress = ProgressMonitor(progress)
+			progress.start(stream_size(stream))
+			callback = progress.read_callback(callback)
+
+		for a in Atom.read(stream, stream.tell(), 0, self, self.atom_classes, interest=interest,
+		                   callback=callback, max_depth=max_depth):
 			self.append(a)
 
-	def write(self, stream):
-		"""Write QuickTime movie to stream."""
-		[atom.write(stream) for atom in self]
+		if progress is not None:
+			progress.finish(stream.tell())
+
+	def write(self, stream, sequential=None, checksum=None, progress=None):
+		"""Write QuickTime movie to stream.
+
+		If sequential is set, or the stream can't report its position (such
+		as a pipe or a socket), the layout of the movie is computed up front
+		and the data is emitted strictly in order, without calling tell() or
+		seek() on the stream.
+
+		If checksum is set to a hashlib algorithm name (such as "md5" or
+		"sha256") or a function returning a hash object, digests of the
+		whole movie and of each top-level atom are computed from the bytes
+		as they are written, and a manifest is returned (see
+		ChecksumStream.manifest()).
+
+		If progress is set to a ProgressMonitor (or a function, which is
+		wrapped in one), it's updated as data is written."""
+		if sequential is None:
+			sequential = not is_seekable(stream)
+
+		if sequential or progress is not None:
+			layout = self.layout()
+			top_level = set([id(atom) for atom in self])
+			top_level_layout = [(offset, size) for offset, size, atom in layout if id(atom) in top_level]
+
+		if progress is not None:
+			if not isinstance(progress, ProgressMonitor):
+				progress = ProgressMonitor(progress)
+			progress.start(sum([size for _, size in top_level_layout]))
+			sink = ProgressStream(stream, progress, layout)
+		elif sequential:
+			sink = SequentialStream(stream)
+		else:
+			sink = stream
+
+		if checksum is not None:
+			sink = ChecksumStream(sink, checksum)
+
+		# The layout is only checked when writing sequentially.
+		if not sequential:
+			top_level_layout = [None] * len(self)
+
+		for atom, expected in zip(self, top_level_layout):
+			if checksum is not None:
+				sink.start_atom(atom.kind)
+
+			atom.write(sink)
+
+			if checksum is not None:
+				sink.finish_atom()
+
+			if expected and sink.tell() != sum(expected):
+				raise QuickTimeWriteError("Wrote %d bytes, expected %d" % (sink.tell() - expected[0], expected[1]), expected[0])
+
+		if progress is not None:
+			progress.finish(sink.tell())
+
+		if checksum is not None:
+			return sink.manifest()
+
+	def layout(self, offset=0):
+		"""Compute the layout of the movie when written. Returns a list of
+		(offset, size, atom) for all atoms, in the order they are written."""
+		result = []
+		for atom in self:
+			result.extend(atom.layout(offset))
+			offset += atom.size
+		return result
 
 	def find(self, types):
 		"""Find atoms of specific types in movie."""
@@ -135,9 +240,14 @@ class Atom(list):
 		super(Atom, self).__init__()
 		self.kind = kind
 		self.parent = None
+		self._raw = None
 		self.fields = {}
 		self.extended_header = False
 
+		# Offset and size of the atom in the stream it was read from, if any.
+		self.source_offset = None
+		self.source_size = None
+
 		# Indicates whether this atom should have a terminating null when serialized.
 		self.terminating_null = False
 
@@ -155,32 +265,72 @@ class Atom(list):
 	def __repr__(self):
 		return "<%s %s>" % (self.__class__.__name__, self.safe_kind)
 
+	@property
+	def path(self):
+		"""Returns the types of this atom and its ancestors, separated by slashes."""
+		kinds = []
+		atom = self
+		while isinstance(atom, Atom):
+			kinds.append(atom.kind)
+			atom = atom.parent
+		return "/".join(reversed(kinds))
+
+	@property
+	def fields(self):
+		"""Field values of this atom. Atoms that were read with their raw data
+		are decoded on first access."""
+		if self._raw is not None:
+			self.decode()
+		return self._fields
+
+	@fields.setter
+	def fields(self, value):
+		self._fields = value
+
 	@property
 	def size(self):
 		"""Calculate and return the size of this atom (including children)."""
 		size = struct.calcsize(self.header)
 		if self.extended_header:
 			size += struct.calcsize(self.header_extsize)
-		for _, format in self.field_defs:
-			size += struct.calcsize(format)
+		if self._raw is not None:
+			size += len(self._raw)
+		else:
+			size += self.data_size
 		for child in self:
 			size += child.size
 		if self.terminating_null:
 			size += 4
 		return size
 
+	@property
+	def data_size(self):
+		"""Calculate and return the size of the atom data (excluding header and children)."""
+		size = 0
+		for _, format in self.field_defs:
+			size += struct.calcsize(format)
+		return size
+
 	@classmethod
 	def supports_type(cls, kind):
 		"""Returns True if this class can handle the given atom type."""
 		return kind in cls.supported_types
 
 	@classmethod
-	def read(cls, stream, start=None, end=0, parent=None, atom_classes=None, force_class=None):
+	def read(cls, stream, start=None, end=0, parent=None, atom_classes=None, force_class=None,
+		     interest=None, callback=None, max_depth=None, depth=0):
 		"""Read atoms from stream.
 
 		The start parameter indicates the offset at which to start reading. End
 		indicates the offset at which to stop reading. This can also be set
 		to 0 to continue until end-of-file, or -1 to stop after the first atom.
+
+		If an InterestSet is given, only the atoms matching it (with all
+		their children) and the containers on the way to them are parsed.
+
+		The callback and max_depth parameters are described in
+		QuickTimeFile.read(). Depth is the depth of the atoms being read,
+		counted from the top-level atoms.
 		"""
 		atoms = []
 
@@ -210,13 +360,46 @@ class Atom(list):
 							handler = c
 							break
 
+				child_interest = interest
+				if handler and interest is not None:
+					if isinstance(parent, Atom):
+						path = parent.path + "/" + kind
+					else:
+						path = kind
+
+					if interest.matches(kind, path):
+						child_interest = None
+					elif not (handler.container and interest.may_contain(path)):
+						handler = None
+
+				if handler and handler.container and max_depth is not None and depth >= max_depth:
+					handler = None
+
 				if handler:
 					atom = handler(kind)
-					atom.read_data(stream, offset + size)
+
+					# The parent is needed up front to know the path of the children.
+					atom.parent = parent
+					atom.extended_header = extended
+					atom.source_offset = offset
+					atom.source_size = size
+
+					# Leaf atoms keep their raw data, and are only decoded if their fields are accessed.
+					# Classes that override size rather than data_size work out their size from the
+					# fields, so they are decoded right away.
+					if atom.container or type(atom).size is not Atom.size:
+						atom.read_data(stream, offset + size)
+					else:
+						atom.read_raw(stream, offset + size)
+
+					# Containers are reported before their children, so atoms are reported in file order.
+					if callback:
+						callback(atom, depth)
 
 					if atom.container:
 
-						for child in Atom.read(stream, stream.tell(), offset + size, atom, atom_classes, atom.force_child_class):
+						for child in Atom.read(stream, stream.tell(), offset + size, atom, atom_classes, atom.force_child_class,
+						                       child_interest, callback, max_depth, depth + 1):
 							atom.append(child)
 
 					if size != atom.size:
@@ -224,9 +407,13 @@ class Atom(list):
 
 				if atom == None:
 					atom = PassthroughAtom(kind, stream, offset, size)
+					atom.parent = parent
+					atom.extended_header = extended
+					atom.source_offset = offset
+					atom.source_size = size
 
-				atom.parent = parent
-				atom.extended_header = extended
+					if callback:
+						callback(atom, depth)
 
 				debug("Instanced with %s" % atom.__class__.__name__, atom.safe_kind, stream)
 
@@ -286,13 +473,47 @@ class Atom(list):
 		for key, format in self.field_defs:
 			self.fields[key] = read_struct(stream, format)
 
+	def read_raw(self, stream, end):
+		"""Read atom data from stream without parsing it. The data is kept
+		as is, and decoded with read_data() when the fields are accessed."""
+		self._raw = stream.read(max(end - stream.tell(), 0))
+
+	def decode(self):
+		"""Decode the fields from the raw data, if the atom still has any. The
+		atom will be serialized from its fields after this. Raises
+		QuickTimeParseError if the raw data can't be parsed (with the offset
+		relative to the start of the data). The raw data is kept if decoding
+		fails, so the atom is still serialized unchanged."""
+		if self._raw is None:
+			return
+
+		# The raw data is cleared while decoding, as read_data() accesses the fields.
+		raw, fields = self._raw, self._fields
+		self._raw = None
+		self._fields = {}
+		stream = cStringIO.StringIO(raw)
+		try:
+			self.read_data(stream, len(raw))
+		except QuickTimeParseError:
+			self._raw, self._fields = raw, fields
+			raise
+		except (struct.error, ValueError, IndexError), e:
+			self._raw, self._fields = raw, fields
+			raise QuickTimeParseError("Could not decode %s: %s" % (self.safe_kind, e), stream.tell())
+
 	def write(self, stream, recursive=True):
 		"""Write atom to stream. If recursive is set to False, child atoms
 		will not be written. If this is used, write_end() must also be called
 		as appropriate."""
 		offset = stream.tell()
 		self.write_header(stream)
-		self.write_data(stream, recursive)
+
+		# Atoms that haven't been decoded are written back exactly as they were read.
+		if self._raw is not None:
+			debug("Writing raw data", self.kind, stream)
+			stream.write(self._raw)
+		else:
+			self.write_data(stream, recursive)
 
 		if recursive:
 			self.write_end(stream)
@@ -333,6 +554,24 @@ class Atom(list):
 				matches.extend(child.find(types, recursive=True))
 		return matches
 
+	def layout(self, offset=0):
+		"""Compute the layout of this atom and its children when written at
+		the given offset. Returns a list of (offset, size, atom)."""
+		size = self.size
+		result = [(offset, size, self)]
+
+		# Children are always written last, before any terminating null.
+		children = [(child, child.size) for child in self]
+		child_offset = offset + size - sum([child_size for _, child_size in children])
+		if self.terminating_null:
+			child_offset -= 4
+
+		for child, child_size in children:
+			result.extend(child.layout(child_offset))
+			child_offset += child_size
+
+		return result
+
 	def free(self):
 		"""Convert Atom to free."""
 		# FIXME: This should also zero all the fields.
@@ -376,12 +615,22 @@ class PassthroughAtom(Atom):
 		self._offset = offset
 		self._size = size
 
+	# Size of the reads used when copying source data.
+	copy_chunk_size = COPY_CHUNK_SIZE
+
 	def write(self, stream, recursive=True):
 		"""Write atom data to stream. As this just passes through the
 		source data, the recursive parameter has no meaning here."""
 		debug("Passing through data", self.kind, stream)
 		self._source.seek(self._offset)
-		stream.write(self._source.read(self._size))
+		remaining = self._size
+		while remaining > 0:
+			data = self._source.read(min(remaining, self.copy_chunk_size))
+			if not data:
+				warning("Partial write [%d->%d], file will probably be corrupt" % (self._size, self._size - remaining), self.kind, stream)
+				break
+			stream.write(data)
+			remaining -= len(data)
 
 	def __repr__(self):
 		return "<%s %s %sb>" % (self.__class__.__name__, self.kind, self.size)
@@ -392,6 +641,238 @@ class PassthroughAtom(Atom):
 		return self._size
 
 
+class InterestSet(object):
+	"""A set of atom types and paths to parse when reading a movie. Paths
+	are slash-separated types from the top level, such as "moov/meta/keys".
+	"""
+
+	def __init__(self, items=()):
+		self.kinds = set()
+		self.paths = set()
+		self.prefixes = set()
+
+		for item in items:
+			if "/" in item:
+				path = item.strip("/")
+				self.paths.add(path)
+				kinds = path.split("/")
+				for i in range(1, len(kinds)):
+					self.prefixes.add("/".join(kinds[:i]))
+			else:
+				self.kinds.add(item)
+
+	def __repr__(self):
+		return "<%s %s>" % (self.__class__.__name__, sorted(self.kinds | self.paths))
+
+	def matches(self, kind, path):
+		"""Returns True if an atom with this type and path is of interest."""
+		return kind in self.kinds or path in self.paths
+
+	def may_contain(self, path):
+		"""Returns True if an atom at this path may contain atoms of interest."""
+		return bool(self.kinds) or path in self.prefixes
+
+
+if hasattr(os, "pread"):
+	pread = os.pread
+else:
+	_pread_lock = threading.Lock()
+
+	def pread(fd, size, offset):
+		"""Fallback for platforms without os.pread(). This is only safe between
+		threads, not between processes sharing the same descriptor."""
+		with _pread_lock:
+			os.lseek(fd, offset, os.SEEK_SET)
+			return os.read(fd, size)
+
+
+class SequentialStream(object):
+	"""A wrapper for write-only streams that can't report their position, such
+	as pipes and sockets. The position is tracked by counting written bytes."""
+
+	def __init__(self, stream, position=0):
+		self.stream = stream
+		self.position = position
+
+	def write(self, data):
+		self.stream.write(data)
+		self.position += len(data)
+
+	def tell(self):
+		return self.position
+
+	def flush(self):
+		self.stream.flush()
+
+
+class ChecksumStream(SequentialStream):
+	"""A wrapper for write-only streams that computes digests of the data as
+	it's written, for the whole stream and for each atom marked with
+	start_atom() and finish_atom(). The hasher is a hashlib algorithm name
+	or a function returning a hash object."""
+
+	def __init__(self, stream, hasher="md5", position=0):
+		super(ChecksumStream, self).__init__(stream, position)
+		if callable(hasher):
+			self.new_hash = hasher
+		else:
+			self.new_hash = lambda: hashlib.new(hasher)
+		self.hash = self.new_hash()
+		self.start = position
+		self.atoms = []
+		self.atom = None
+
+	def write(self, data):
+		super(ChecksumStream, self).write(data)
+		self.hash.update(data)
+		if self.atom:
+			self.atom[2].update(data)
+
+	def start_atom(self, kind):
+		self.atom = (kind, self.position, self.new_hash())
+
+	def finish_atom(self):
+		kind, offset, atom_hash = self.atom
+		self.atoms.append({"kind": kind.encode("string_escape"),
+						   "offset": offset - self.start,
+						   "size": self.position - offset,
+						   "digest": atom_hash.hexdigest()})
+		self.atom = None
+
+	def manifest(self):
+		"""Returns a dict with the keys "algorithm", "size" and "digest" for the
+		whole stream, and "atoms" with a dict for each atom with the keys "kind",
+		"offset", "size" and "digest"."""
+		name = getattr(self.hash, "name", None)
+		return {"algorithm": name.lower() if name else None,
+				"size": self.position - self.start,
+				"digest": self.hash.hexdigest(),
+				"atoms": self.atoms}
+
+
+def write_manifest(manifest, path):
+	"""Write a checksum manifest to a JSON file, such as a sidecar file next to the movie."""
+	with open(path, "w") as f:
+		json.dump(manifest, f, indent=4, separators=(",", ": "), sort_keys=True)
+		f.write("\n")
+
+
+class ProgressMonitor(object):
+	"""Reports the progress of a read or write to a callback, at most once
+	every interval seconds and once when done. The callback is called with a
+	dict with the keys "bytes", "total" (None if unknown), "path" of the
+	current atom (None if unknown), "elapsed" seconds, "rate" in bytes per
+	second since the previous report and "average_rate" since the start."""
+
+	def __init__(self, callback, interval=1.0):
+		self.callback = callback
+		self.interval = interval
+		self.start()
+
+	def start(self, total=None):
+		self.total = total
+		self.start_time = self.last_time = time.time()
+		self.next_time = self.start_time + self.interval
+		self.last_bytes = 0
+
+	def update(self, bytes, atom=None):
+		"""Report the progress if the interval has passed since the last report."""
+		if time.time() >= self.next_time:
+			self.report(bytes, atom)
+
+	def finish(self, bytes):
+		self.report(bytes)
+
+	def report(self, bytes, atom=None):
+		now = time.time()
+		elapsed = now - self.start_time
+		self.callback({"bytes": bytes,
+					   "total": self.total,
+					   "path": atom.path.encode("string_escape") if isinstance(atom, Atom) else None,
+					   "elapsed": elapsed,
+					   "rate": (bytes - self.last_bytes) / max(now - self.last_time, 1e-6),
+					   "average_rate": bytes / max(elapsed, 1e-6)})
+		self.last_time = now
+		self.last_bytes = bytes
+		self.next_time = now + self.interval
+
+	def read_callback(self, callback=None):
+		"""Returns a callback for Atom.read() that updates the progress, and then calls the given callback."""
+		def update(atom, depth):
+			# Containers are reported before their children are read.
+			if atom.container:
+				self.update(atom.source_offset, atom)
+			else:
+				self.update(atom.source_offset + atom.source_size, atom)
+			if callback:
+				callback(atom, depth)
+		return update
+
+
+class ProgressStream(SequentialStream):
+	"""A wrapper for write-only streams that updates a ProgressMonitor. The
+	layout from QuickTimeFile.layout() is used to find the atom being written
+	when the progress is reported."""
+
+	def __init__(self, stream, monitor, layout=None, position=0):
+		super(ProgressStream, self).__init__(stream, position)
+		self.monitor = monitor
+		self.layout = layout or []
+		self.offsets = [offset for offset, _, _ in self.layout]
+
+	def write(self, data):
+		super(ProgressStream, self).write(data)
+		if time.time() >= self.monitor.next_time:
+			self.monitor.report(self.position, self.atom_at(self.position))
+
+	def atom_at(self, position):
+		"""Returns the innermost atom being written at a position, or None."""
+		index = bisect.bisect_right(self.offsets, position) - 1
+		if index < 0:
+			return None
+		offset, size, atom = self.layout[index]
+
+		# The last atom to start may have ended already, leaving us in one of its ancestors.
+		if position >= offset + size:
+			ends = dict([(id(a), o + s) for o, s, a in self.layout[:index]])
+			while isinstance(atom, Atom) and ends.get(id(atom), 0) <= position:
+				atom = atom.parent
+
+		if isinstance(atom, Atom):
+			return atom
+		return None
+
+
+def format_progress(report):
+	"""Returns a progress report from ProgressMonitor as a line of text."""
+	mb = 1024.0 * 1024.0
+	text = "%.1f MB" % (report["bytes"] / mb)
+	if report["total"]:
+		text += " / %.1f MB (%d%%)" % (report["total"] / mb, 100 * report["bytes"] / report["total"])
+	text += " | %.1f MB/s (average %.1f MB/s)" % (report["rate"] / mb, report["average_rate"] / mb)
+	if report["path"]:
+		text += " | %s" % report["path"]
+	return text
+
+
+def stream_size(stream):
+	"""Returns the size of the file behind a stream, or None if it's unknown."""
+	try:
+		size = os.fstat(stream.fileno()).st_size
+	except (AttributeError, IOError, OSError):
+		return None
+	return size or None
+
+
+def is_seekable(stream):
+	"""Returns True if the stream can report its position and seek."""
+	try:
+		stream.tell()
+	except (AttributeError, IOError, OSError):
+		return False
+	return hasattr(stream, "seek")
+
+
 def debug(message, scope, stream):
 	if stream:
 		position = stream.tell()
@@ -435,6 +916,57 @@ def read_struct(stream, format, unwrap=True):
 		raise QuickTimeParseError("Could not unpack data", stream.tell())
 
 
+def read_table(stream, format, end, unwrap=True):
+	"""Read and unpack a table of rows with the same structure from a stream,
+	up to the end offset. Returns a list of rows. Raises QuickTimeParseError
+	if the data doesn't contain a whole number of rows. If unwrap is set,
+	rows with a single value will be unwrapped."""
+	row_size = struct.calcsize(format)
+	buf = stream.read(max(end - stream.tell(), 0))
+	count, remainder = divmod(len(buf), row_size)
+	if remainder:
+		raise QuickTimeParseError("Expected rows of %d bytes, got %d bytes" % (row_size, len(buf)), stream.tell())
+
+	# Unpack the whole table at once, using a repeat count when all columns have the same type.
+	byte_order = format[:1] if format[:1] in "@=<>!" else ""
+	codes = format[len(byte_order):]
+	if codes.isalpha() and len(set(codes)) == 1:
+		table_format = "%s%d%s" % (byte_order, count * len(codes), codes[0])
+	else:
+		table_format = byte_order + codes * count
+
+	try:
+		values = struct.unpack(table_format, buf)
+	except struct.error:
+		raise QuickTimeParseError("Could not unpack table", stream.tell())
+
+	columns = len(values) / count if count else 0
+	if unwrap and columns == 1:
+		return list(values)
+	return zip(*[iter(values)] * columns)
+
+
+def write_table(stream, format, table):
+	"""Pack and write a table of rows with the same structure to a stream. This
+	is the reverse of read_table(), rows can be tuples or single values."""
+	if not table:
+		return
+
+	if isinstance(table[0], tuple):
+		values = list(itertools.chain.from_iterable(table))
+	else:
+		values = table
+
+	byte_order = format[:1] if format[:1] in "@=<>!" else ""
+	codes = format[len(byte_order):]
+	if codes.isalpha() and len(set(codes)) == 1:
+		table_format = "%s%d%s" % (byte_order, len(values), codes[0])
+	else:
+		table_format = byte_order + codes * len(table)
+
+	stream.write(struct.pack(table_format, *values))
+
+
 class QuickTimeParseError(Exception):
 	"""Raised if an error is encountered during parsing of a QuickTime movie."""
 	def __init__(self, message, offset = 0):
@@ -446,6 +978,17 @@ class QuickTimeParseError(Exception):
 		return "@%d: %s" % (self.offset, self.message)
 
 
+class QuickTimeWriteError(Exception):
+	"""Raised if the data written for a QuickTime movie doesn't match its layout."""
+	def __init__(self, message, offset = 0):
+		Exception.__init__(self, message)
+		self.message = message
+		self.offset = offset
+
+	def __str__(self):
+		return "@%d: %s" % (self.offset, self.message)
+
+
 class QuickTimeEOF(Exception):
 	"""Raised if EOF is encountered during parsing of a QuickTime movie."""
 	pass
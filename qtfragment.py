@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+
+
+import os
+import sys
+import struct
+import logging
+import optparse
+import itertools
+
+import qtfile
+import qtatoms
+import qttracks
+from qtatoms import pack_flags
+
+
+USAGE = """Usage: %prog [options] <input_movie> <output_movie>
+
+Convert a progressive movie to a fragmented one. The output has a "sidx" index
+after the "moov" atom, a "moof" and "mdat" atom for each fragment and an "mfra"
+random access index at the end. Fragments start at sync samples of the first
+video track (or the first track, if there is no video). The output movie can
+be "-" to write to stdout.
+"""
+
+# Sample flags used in track runs, for sync and non-sync samples.
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+# Sample table atoms that only describe progressive samples, which are removed.
+PROGRESSIVE_TYPES = ["stss", "ctts", "stps", "sdtp"]
+
+
+class FragmentTrack(object):
+	"""A cursor over the samples of a track. The samples are walked in order from
+	the sample tables, which stay run-length encoded, so per-sample values are
+	only expanded for the fragment being built."""
+
+	def __init__(self, trak):
+		table = qttracks.SampleTable(trak)
+		self.trak = trak
+		self.track_id = qttracks.track_id(trak)
+		self.handler_type = qttracks.handler_type(trak)
+		self.timescale = table.timescale
+
+		# Keep the tables themselves, prepare_moov() replaces them in the atoms.
+		if table.time_to_sample_atom is None:
+			raise qtfile.QuickTimeParseError("Track has no parsed stts atom")
+		stsz = table.sample_size_atom
+		if stsz["sample_size"]:
+			self.sample_size = stsz["sample_size"]
+			self.sample_count = stsz["num_table_entries"]
+			self.sample_sizes = None
+		else:
+			self.sample_size = 0
+			self.sample_count = len(stsz["table"])
+			self.sample_sizes = stsz["table"]
+		self.chunk_offsets = table.chunk_offsets
+		self.sample_to_chunk = table.sample_to_chunk_atom["table"]
+		self.time_to_sample = table.time_to_sample_atom["table"]
+		self.composition_offsets = None
+		if table.composition_offset_atom is not None:
+			self.composition_offsets = table.composition_offset_atom["table"]
+		self.sync_samples = None
+		if table.sync_sample_atom is not None:
+			self.sync_samples = sorted(table.sync_sample_atom["table"])
+
+		# The sample description in "trex", used unless "tfhd" sets another one.
+		rows = self.sample_to_chunk
+		self.description_index = rows[0][2] if rows else 1
+
+		self.rewind()
+
+	def __repr__(self):
+		return "<%s %s %s>" % (self.__class__.__name__, self.track_id, self.handler_type)
+
+	def rewind(self):
+		"""Go back to the first sample."""
+		self.decode_time = 0
+		self.samples = self.walk_samples()
+		self.pending = next(self.samples, None)
+
+	@property
+	def done(self):
+		return self.pending is None
+
+	def next_is_sync(self):
+		return self.pending is not None and self.pending[4]
+
+	def take(self):
+		"""Returns the next sample as (offset, size, duration, composition_offset,
+		is_sync, description_index) and moves past it."""
+		sample = self.pending
+		self.decode_time += sample[2]
+		self.pending = next(self.samples, None)
+		return sample
+
+	def walk_samples(self):
+		if self.sample_sizes is None:
+			sizes = itertools.repeat(self.sample_size, self.sample_count)
+		else:
+			sizes = self.sample_sizes
+		durations = expand_runs(self.time_to_sample)
+		if self.composition_offsets is None:
+			composition_offsets = itertools.repeat(0)
+		else:
+			composition_offsets = itertools.chain(expand_runs(self.composition_offsets), itertools.repeat(0))
+		if self.sync_samples is None:
+			syncs = itertools.repeat(True)
+		else:
+			syncs = sync_flags(self.sync_samples)
+		layout = chunk_layout(self.chunk_offsets, self.sample_to_chunk, sizes)
+		for (offset, size, description_index), duration, composition_offset, sync in itertools.izip(layout, durations, composition_offsets, syncs):
+			yield offset, size, duration, composition_offset, sync, description_index
+
+
+def expand_runs(rows):
+	"""Yields the values of a run-length table of (count, value) rows, one per sample."""
+	for count, value in rows:
+		for _ in xrange(count):
+			yield value
+
+
+def sync_flags(sync_samples):
+	"""Yields whether each sample is a sync sample, from a sorted list of sample numbers."""
+	numbers = iter(sync_samples)
+	next_sync = next(numbers, None)
+	for number in itertools.count(1):
+		while next_sync is not None and next_sync < number:
+			next_sync = next(numbers, None)
+		yield number == next_sync
+
+
+def chunk_layout(chunk_offsets, sample_to_chunk, sizes):
+	"""Yields (offset, size, description_index) for each sample, from the chunk
+	offsets and the sample-to-chunk table."""
+	sizes = iter(sizes)
+	for i, (first_chunk, samples, description_index) in enumerate(sample_to_chunk):
+		if i + 1 < len(sample_to_chunk):
+			end_chunk = sample_to_chunk[i + 1][0] - 1
+		else:
+			end_chunk = len(chunk_offsets)
+		for chunk in xrange(first_chunk - 1, min(end_chunk, len(chunk_offsets))):
+			offset = chunk_offsets[chunk]
+			for size in itertools.islice(sizes, samples):
+				yield offset, size, description_index
+				offset += size
+
+
+def fragment(qt, source, output, duration=2.0):
+	"""Write a fragmented version of a movie. The source is the stream the movie
+	was read from, and duration is the target duration of each fragment in seconds.
+
+	The "moov" atom of the movie is modified in place: the sample tables are
+	emptied and an "mvex" atom is added. The samples are walked twice, once to
+	size the fragments for the "sidx" atom and once to write them, and only the
+	samples of the current fragment are expanded, with their data copied straight
+	from the source.
+	"""
+	moov = qttracks.find_moov(qt)
+	if moov.find("mvex", recursive=False):
+		raise ValueError("Movie is already fragmented")
+
+	# Tracks without samples are kept, but only get a "trex" atom.
+	all_tracks = [FragmentTrack(trak) for trak in moov.find("trak", recursive=False)]
+	tracks = [track for track in all_tracks if not track.done]
+	if not tracks:
+		raise ValueError("Movie has no tracks with samples")
+
+	video = [track for track in tracks if track.handler_type == "vide"]
+	reference = (video or tracks)[0]
+
+	sidx = build_sidx(tracks, reference, duration)
+	prepare_moov(moov, all_tracks)
+
+	header_atoms = [atom for atom in qt if atom.kind == "ftyp"][:1]
+	if not header_atoms:
+		ftyp = qtatoms.FileTypeAtom("ftyp")
+		ftyp.fields.update(major_brand="iso6", minor_brand=0, compatible_brands=["iso6"])
+		header_atoms.append(ftyp)
+	elif "iso6" not in header_atoms[0]["compatible_brands"]:
+		header_atoms[0]["compatible_brands"].append("iso6")
+	header_atoms.extend([moov, sidx])
+
+	if not qtfile.is_seekable(output):
+		output = qtfile.SequentialStream(output)
+
+	position = 0
+	for atom in header_atoms:
+		atom.write(output)
+		position += atom.size
+
+	random_access = dict([(track.track_id, []) for track in tracks])
+
+	for sequence, parts in enumerate(iter_fragments(tracks, reference, duration), 1):
+		moof, mdat, payload_size = build_fragment(sequence, parts)
+
+		for traf_number, (track, base_time, samples) in enumerate(parts, 1):
+			if samples[0][4]:
+				random_access[track.track_id].append((max(base_time + samples[0][3], 0), position, traf_number, 1, 1))
+
+		moof.write(output)
+		output.write(mdat)
+
+		for track, _, samples in parts:
+			offsets = [sample[0] for sample in samples]
+			sizes = [sample[1] for sample in samples]
+			for offset, size, _ in qttracks.contiguous_runs(offsets, sizes):
+				qttracks.copy_range(source, output, offset, size)
+
+		position += moof.size + len(mdat) + payload_size
+
+	build_mfra(tracks, random_access).write(output)
+
+
+def iter_fragments(tracks, reference, duration):
+	"""Split the samples of all tracks into fragments, starting from the first
+	sample. Yields a list of (track, base_decode_time, samples) for each fragment,
+	where samples is a list of samples as returned by FragmentTrack.take(). Tracks
+	without samples in the fragment are left out, and tracks with samples of more
+	than one sample description have a part for each of them."""
+	for track in tracks:
+		track.rewind()
+	target = int(duration * reference.timescale)
+
+	while not reference.done:
+		# Fragments end at the first sync sample of the reference track after the target duration.
+		start = reference.decode_time
+		reference_samples = [reference.take()]
+		while not reference.done and not (reference.decode_time >= start + target and reference.next_is_sync()):
+			reference_samples.append(reference.take())
+
+		# The other tracks are split at the same time, converted to their own timescale.
+		parts = []
+		for track in tracks:
+			if track is reference:
+				parts.extend(split_descriptions(reference, start, reference_samples))
+				continue
+			if reference.done:
+				end = None
+			else:
+				end = -(-reference.decode_time * track.timescale // reference.timescale)
+			base_time = track.decode_time
+			samples = []
+			while not track.done and (end is None or track.decode_time < end):
+				samples.append(track.take())
+			parts.extend(split_descriptions(track, base_time, samples))
+		yield parts
+
+
+def split_descriptions(track, base_time, samples):
+	"""Split samples of a track into runs with the same sample description, as
+	a "traf" atom only refers to one. Returns a list of (track, base_decode_time,
+	samples)."""
+	parts = []
+	for _, run in itertools.groupby(samples, key=lambda sample: sample[5]):
+		run = list(run)
+		parts.append((track, base_time, run))
+		base_time += sum([sample[2] for sample in run])
+	return parts
+
+
+def prepare_moov(moov, tracks):
+	"""Empty the sample tables of all tracks and add default values for fragments."""
+	for track in tracks:
+		for stbl in track.trak.find("stbl"):
+			stbl[:] = [atom for atom in stbl if atom.kind not in PROGRESSIVE_TYPES]
+			for atom in stbl:
+				if isinstance(atom, qtatoms.TableAtom):
+					atom["table"] = []
+					atom["num_table_entries"] = 0
+				if isinstance(atom, qtatoms.SampleSizeAtom):
+					atom["sample_size"] = 0
+
+	mvex = add_atom(moov, qtatoms.ContainerAtom("mvex"))
+	for track in tracks:
+		add_atom(mvex, qtatoms.TrackExtendsAtom("trex"),
+				 version="\x00",
+				 flags=pack_flags(0),
+				 track_id=track.track_id,
+				 default_sample_description_index=track.description_index,
+				 default_sample_duration=0,
+				 default_sample_size=0,
+				 default_sample_flags=0)
+
+
+def new_moof(sequence):
+	"""Build a "moof" atom with only its "mfhd" header."""
+	moof = qtatoms.ContainerAtom("moof")
+	add_atom(moof, qtatoms.MovieFragmentHeaderAtom("mfhd"),
+			 version="\x00",
+			 flags=pack_flags(0),
+			 sequence_number=sequence)
+	return moof
+
+
+def add_traf(moof, track, base_time, samples):
+	"""Add a "traf" atom for some samples of a track to a "moof" atom. The samples
+	must all have the same sample description. Returns its "trun" atom, with the
+	data offset left at 0."""
+	traf = add_atom(moof, qtatoms.ContainerAtom("traf"))
+	tfhd = add_atom(traf, qtatoms.TrackFragmentHeaderAtom("tfhd"),
+					version="\x00",
+					flags=pack_flags(qtatoms.TrackFragmentHeaderAtom.default_base_is_moof),
+					track_id=track.track_id)
+
+	# Samples with another description than the default in "trex" need it in "tfhd".
+	if samples and samples[0][5] != track.description_index:
+		tfhd["flags"] = pack_flags(qtatoms.TrackFragmentHeaderAtom.default_base_is_moof | 0x000002)
+		tfhd["sample_description_index"] = samples[0][5]
+
+	add_atom(traf, qtatoms.TrackFragmentDecodeTimeAtom("tfdt"),
+			 version="\x01",
+			 flags=pack_flags(0),
+			 base_media_decode_time=base_time)
+
+	flags = 0x000001 | 0x000100 | 0x000200
+	rows = [(duration, size) for _, size, duration, _, _, _ in samples]
+	if track.sync_samples is not None:
+		flags |= 0x000400
+		rows = [row + (SYNC_SAMPLE_FLAGS if sample[4] else NON_SYNC_SAMPLE_FLAGS,) for row, sample in zip(rows, samples)]
+	if track.composition_offsets is not None:
+		flags |= 0x000800
+		rows = [row + (sample[3],) for row, sample in zip(rows, samples)]
+
+	return add_atom(traf, qtatoms.TrackRunAtom("trun"),
+					version="\x01",
+					flags=pack_flags(flags),
+					sample_count=len(samples),
+					data_offset=0,
+					samples=rows)
+
+
+def traf_size(track, samples):
+	"""Returns the size of the "traf" atom that add_traf() adds for some samples,
+	only building it with the first sample."""
+	trun = add_traf(qtatoms.ContainerAtom("moof"), track, 0, samples[:1])
+	return trun.parent.size + (len(samples) - 1) * struct.calcsize(trun.sample_row_format)
+
+
+def build_fragment(sequence, parts):
+	"""Build the "moof" atom for a fragment. Returns (moof, mdat_header,
+	payload_size), with the data offsets pointing into the following "mdat"."""
+	moof = new_moof(sequence)
+	runs = [add_traf(moof, track, base_time, samples) for track, base_time, samples in parts]
+
+	payload_sizes = [sum([sample[1] for sample in samples]) for _, _, samples in parts]
+	payload_size = sum(payload_sizes)
+	mdat = qttracks.mdat_header(payload_size)
+
+	# Data offsets are relative to the start of the "moof" atom.
+	offset = moof.size + len(mdat)
+	for trun, size in zip(runs, payload_sizes):
+		trun["data_offset"] = offset
+		offset += size
+
+	return moof, mdat, payload_size
+
+
+def build_sidx(tracks, reference, duration):
+	"""Build a "sidx" atom indexing every fragment, timed by the reference track.
+	Fragment sizes are worked out with traf_size(), without building the "moof"
+	atoms."""
+	header_size = new_moof(0).size
+	references = []
+	earliest_presentation_time = None
+	for parts in iter_fragments(tracks, reference, duration):
+		moof_size = header_size
+		payload_size = 0
+		fragment_duration = 0
+		sap = None
+		for track, base_time, samples in parts:
+			moof_size += traf_size(track, samples)
+			payload_size += sum([sample[1] for sample in samples])
+			if track is reference:
+				if earliest_presentation_time is None:
+					earliest_presentation_time = max(base_time + samples[0][3], 0)
+				if sap is None:
+					sap = 1 if samples[0][4] else 0
+				fragment_duration += sum([sample[2] for sample in samples])
+		size = moof_size + len(qttracks.mdat_header(payload_size)) + payload_size
+		references.append((0, size, fragment_duration, sap, sap, 0))
+
+	sidx = qtatoms.SegmentIndexAtom("sidx")
+	sidx.fields.update(version="\x01",
+					   flags=pack_flags(0),
+					   reference_id=reference.track_id,
+					   timescale=reference.timescale,
+					   earliest_presentation_time=earliest_presentation_time,
+					   first_offset=0,
+					   reserved=0,
+					   reference_count=len(references),
+					   references=references)
+	return sidx
+
+
+def build_mfra(tracks, random_access):
+	"""Build an "mfra" atom from the random access points of each track, which
+	are lists of (time, moof_offset, traf_number, trun_number, sample_number)."""
+	mfra = qtatoms.ContainerAtom("mfra")
+	for track in tracks:
+		entries = random_access[track.track_id]
+		add_atom(mfra, qtatoms.TrackFragmentRandomAccessAtom("tfra"),
+				 version="\x01",
+				 flags=pack_flags(0),
+				 track_id=track.track_id,
+				 length_sizes=0,
+				 number_of_entries=len(entries),
+				 entries=entries)
+
+	mfro = add_atom(mfra, qtatoms.MovieFragmentRandomAccessOffsetAtom("mfro"),
+					version="\x00",
+					flags=pack_flags(0),
+					size=0)
+	mfro["size"] = mfra.size
+	return mfra
+
+
+def add_atom(parent, atom, **fields):
+	"""Add a new atom with the given fields to a parent atom."""
+	atom.fields.update(fields)
+	atom.parent = parent
+	parent.append(atom)
+	return atom
+
+
+def main(argv):
+	parser = optparse.OptionParser(usage=USAGE)
+	parser.add_option("-D", "--debug", action="store_true", help="Enable debugging output")
+	parser.add_option("-d", "--duration", type="float", default=2.0, help="Target fragment duration in seconds (default: 2)")
+
+	opts, args = parser.parse_args(argv)
+	if len(args) == 3:
+		source, dest = args[1:]
+	else:
+		parser.error("missing mandatory arguments (need source and destination path)")
+
+	if opts.debug:
+		logging.basicConfig(format="%(asctime)s | %(message)s", level=logging.DEBUG)
+	else:
+		logging.basicConfig(format="%(asctime)s | %(message)s", level=logging.INFO)
+
+	source_stream = open(source, 'rb')
+	qt = qtfile.QuickTimeFile(source_stream, atom_modules=[qtatoms])
+
+	if dest == "-":
+		target = sys.stdout
+	else:
+		target = open(dest, 'wb')
+
+	try:
+		fragment(qt, source_stream, target, opts.duration)
+	except (ValueError, qtfile.QuickTimeParseError), e:
+		print >>sys.stderr, "%s: %s" % (source, e)
+		if dest != "-":
+			target.close()
+			os.remove(dest)
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
@@ -8,6 +8,7 @@ import os
 
 import qtfile
 import qtatoms
+import qttracks
 
 
 USAGE = """Usage: %prog [options] <input_movie> <output_movie>
@@ -17,6 +18,18 @@ can be specified separated by commas. Field modifications should be specified
 in the format key:converter:value, for example:
 
 	$ qtknife.py -M colr -F matrix:int:2 input.mov output.mov
+
+The output movie can be "-" to write to stdout, which may be a pipe.
+
+Tracks can be extracted to a new movie by media handler type or track ID,
+copying only the sample data of those tracks:
+
+	$ qtknife.py -X soun,3 input.mov output.mov
+
+Checksums of the output movie and each top-level atom can be computed while
+writing, and saved to a JSON manifest:
+
+	$ qtknife.py -C sha256 -m output.json -M colr -F matrix:int:2 input.mov output.mov
 """
 
 
@@ -27,6 +40,10 @@ def main(argv):
 	parser.add_option("-M", "--modify-types", default=None, help="Modify specific atom types")
 	parser.add_option("-F", "--fields", default=None, help="Modify atom field values")
 	parser.add_option("-S", "--strip-types", default=None, help="Strip specific atom types")
+	parser.add_option("-X", "--extract-tracks", default=None, help="Extract specific tracks, by handler type or track ID")
+	parser.add_option("-C", "--checksum", default=None, help="Compute checksums of the output with this hash algorithm, such as md5 or sha256")
+	parser.add_option("-m", "--manifest", default=None, help="Write checksums to this JSON manifest (default algorithm: md5)")
+	parser.add_option("-P", "--progress", type="float", default=None, metavar="SECONDS", help="Show progress and throughput on stderr at this interval")
 
 	opts, args = parser.parse_args(argv)
 	if opts.modify_types:
@@ -44,6 +61,19 @@ def main(argv):
 	else:
 		strip_types = []
 
+	extract_handler_types = []
+	extract_track_ids = []
+	if opts.extract_tracks:
+		for track in opts.extract_tracks.split(","):
+			if track.isdigit():
+				extract_track_ids.append(int(track))
+			else:
+				extract_handler_types.append(track)
+
+	checksum = opts.checksum
+	if opts.manifest and not checksum:
+		checksum = "md5"
+
 	converters = {"str": str,
 				  "int": int}
 
@@ -57,26 +87,61 @@ def main(argv):
 	else:
 		logging.basicConfig(format="%(asctime)s | %(message)s", level=logging.INFO)
 
-	qt = qtfile.QuickTimeFile(source, atom_modules=[qtatoms])
-	target = open(dest, 'wb', 0)
+	# Only parse the atoms that will be modified, everything else is passed through.
+	# Extracting tracks needs the complete sample tables, so then everything is parsed.
+	if opts.extract_tracks:
+		interest = None
+	else:
+		interest = modify_types + strip_types
+
+	if opts.progress is not None:
+		progress = qtfile.ProgressMonitor(lambda report: sys.stderr.write(qtfile.format_progress(report) + "\n"), opts.progress)
+	else:
+		progress = None
+
+	source_stream = open(source, 'rb')
+	qt = qtfile.QuickTimeFile(source_stream, atom_modules=[qtatoms], interest=interest, progress=progress)
+
+	# Writing to stdout allows piping the movie elsewhere, so keep the messages out of the way.
+	if dest == "-":
+		target = sys.stdout
+		messages = sys.stderr
+	else:
+		target = open(dest, 'wb', 0)
+		messages = sys.stdout
 
 	for kind in strip_types:
 		for atom in qt.find(kind):
-			print "%s -> [free]" % (atom)
+			print >>messages, "%s -> [free]" % (atom)
 			atom.free()
 
 	for kind in modify_types:
 		for atom in qt.find(kind):
-			print atom
+			print >>messages, atom
 			for key, converter, value in [f.split(":") for f in fields]:
 				if atom.has_key(key):
 					previous_value = atom[key]
 					atom[key] = converters.get(converter, str)(value)
-					print "| %s=%s -> %s" % (key, previous_value, value)
+					print >>messages, "| %s=%s -> %s" % (key, previous_value, value)
 				else:
-					print "| %s (no such field)" % (key)
+					print >>messages, "| %s (no such field)" % (key)
+
+	if opts.extract_tracks:
+		try:
+			manifest = qttracks.extract_tracks(qt, source_stream, target, extract_handler_types, extract_track_ids, checksum, progress)
+		except (ValueError, qtfile.QuickTimeParseError), e:
+			print >>sys.stderr, "%s: %s" % (source, e)
+			if dest != "-":
+				target.close()
+				os.remove(dest)
+			return 1
+	else:
+		manifest = qt.write(target, checksum=checksum, progress=progress)
 
-	qt.write(target)
+	if manifest:
+		print >>messages, "%s (%s) = %s" % (manifest["algorithm"], dest, manifest["digest"])
+		if opts.manifest:
+			qtfile.write_manifest(manifest, opts.manifest)
 	return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,409 @@
+"""
+PyQTFile
+========
+
+This module provides helpers for working with the samples of individual tracks,
+using the sample tables of each track ("stsc", "stsz", "stco", "co64", "stts",
+"stss" and "ctts").
+"""
+
+
+import Queue
+import struct
+import bisect
+import itertools
+import threading
+
+import qtfile
+import qtatoms
+from qtfile import QuickTimeParseError
+
+
+# Maximum size of the reads used when iterating over samples, unless a single sample is larger.
+SAMPLE_READ_SIZE = 16 * 1024 * 1024
+
+
+class SampleTable(object):
+	"""Layout of the samples in a track, as described by its sample tables."""
+
+	def __init__(self, trak):
+		self.trak = trak
+		self.chunk_offset_atom = table_atom(trak, ["stco", "co64"])
+		self.sample_to_chunk_atom = table_atom(trak, ["stsc"])
+		self.sample_size_atom = table_atom(trak, ["stsz"])
+
+		# These are only needed for timing, and the last two are optional.
+		self.time_to_sample_atom = table_atom(trak, ["stts"], required=False)
+		self.sync_sample_atom = table_atom(trak, ["stss"], required=False)
+		self.composition_offset_atom = table_atom(trak, ["ctts"], required=False)
+		self.media_header_atom = table_atom(trak, ["mdhd"], required=False)
+
+	@property
+	def timescale(self):
+		"""Returns the number of time units per second of the track media."""
+		if self.media_header_atom is None:
+			raise QuickTimeParseError("Track has no parsed mdhd atom")
+		return self.media_header_atom["timescale"]
+
+	@property
+	def chunk_offsets(self):
+		"""Returns the file offset of each chunk."""
+		return self.chunk_offset_atom["table"]
+
+	@property
+	def sample_sizes(self):
+		"""Returns the size of each sample."""
+		return self.sample_size_atom.sample_sizes
+
+	def samples_per_chunk(self):
+		"""Returns the number of samples in each chunk."""
+		rows = self.sample_to_chunk_atom["table"]
+		chunk_count = len(self.chunk_offsets)
+		counts = []
+		for i, (first_chunk, samples, _) in enumerate(rows):
+			if i + 1 < len(rows):
+				next_chunk = rows[i + 1][0]
+			else:
+				next_chunk = chunk_count + 1
+			counts.extend([samples] * (next_chunk - first_chunk))
+		return counts[:chunk_count]
+
+	def sample_offsets(self):
+		"""Returns the file offset of each sample."""
+		sizes = self.sample_sizes
+		offsets = []
+		sample = 0
+		for offset, count in zip(self.chunk_offsets, self.samples_per_chunk()):
+			for size in sizes[sample:sample + count]:
+				offsets.append(offset)
+				offset += size
+			sample += count
+		return offsets
+
+	def sample_durations(self):
+		"""Returns the duration of each sample, in the timescale of the track."""
+		if self.time_to_sample_atom is None:
+			raise QuickTimeParseError("Track has no parsed stts atom")
+		durations = []
+		for count, duration in self.time_to_sample_atom["table"]:
+			durations.extend([duration] * count)
+		return durations
+
+	def decode_times(self):
+		"""Returns the decoding time of each sample, in the timescale of the track."""
+		times = []
+		time = 0
+		for duration in self.sample_durations():
+			times.append(time)
+			time += duration
+		return times
+
+	def composition_offsets(self):
+		"""Returns the offset from decoding to composition time of each sample, or
+		None if they are all zero."""
+		if self.composition_offset_atom is None:
+			return None
+		offsets = []
+		for count, offset in self.composition_offset_atom["table"]:
+			offsets.extend([offset] * count)
+		return offsets
+
+	def sync_samples(self):
+		"""Returns a set of the (zero-based) indices of all sync samples, or None
+		if every sample is a sync sample."""
+		if self.sync_sample_atom is None:
+			return None
+		return set([number - 1 for number in self.sync_sample_atom["table"]])
+
+	def chunks(self):
+		"""Returns a list of (offset, size, first_sample, sample_count) for each chunk."""
+		sizes = self.sample_sizes
+		chunks = []
+		sample = 0
+		for offset, count in zip(self.chunk_offsets, self.samples_per_chunk()):
+			chunks.append((offset, sum(sizes[sample:sample + count]), sample, count))
+			sample += count
+		return chunks
+
+
+def table_atom(trak, types, required=True):
+	"""Returns the first parsed sample table atom of specific types in a track.
+	If there is none, QuickTimeParseError is raised if it's required, otherwise
+	None is returned."""
+	for atom in trak.find(types):
+		if not isinstance(atom, qtfile.PassthroughAtom):
+			return atom
+	if required:
+		raise QuickTimeParseError("Track has no parsed %s atom" % "/".join(types))
+	return None
+
+
+def track_id(trak):
+	"""Returns the ID of a track, from its track header."""
+	for tkhd in trak.find("tkhd", recursive=False):
+		return tkhd["track_id"]
+	return None
+
+
+def handler_type(trak):
+	"""Returns the media handler type of a track, such as "vide" or "soun"."""
+	for mdia in trak.find("mdia", recursive=False):
+		for hdlr in mdia.find("hdlr", recursive=False):
+			return hdlr["handler_type"]
+	return None
+
+
+def find_moov(qt):
+	"""Returns the top-level "moov" atom of a movie. Raises QuickTimeParseError
+	if there is none."""
+	for atom in qt:
+		if atom.kind == "moov":
+			return atom
+	raise QuickTimeParseError("Movie has no moov atom")
+
+
+def find_tracks(qt, handler_types=(), track_ids=()):
+	"""Find tracks in a movie by media handler type or track ID."""
+	return [trak for trak in qt.find("trak")
+			if handler_type(trak) in handler_types or track_id(trak) in track_ids]
+
+
+def coalesce(ranges):
+	"""Merge (offset, size) ranges that are adjacent or overlapping. Returns a
+	sorted list of (offset, size)."""
+	merged = []
+	for offset, size in sorted(ranges):
+		if merged and offset <= merged[-1][0] + merged[-1][1]:
+			start, length = merged[-1]
+			merged[-1] = (start, max(length, offset + size - start))
+		else:
+			merged.append((offset, size))
+	return merged
+
+
+def contiguous_runs(offsets, sizes, max_size=None):
+	"""Merge consecutive samples that are also contiguous in the file. Returns a
+	list of (offset, size, sample_count), in sample order. If max_size is set,
+	runs are not merged beyond that size."""
+	runs = []
+	for offset, size in zip(offsets, sizes):
+		if runs and runs[-1][0] + runs[-1][1] == offset and (max_size is None or runs[-1][1] + size <= max_size):
+			start, length, count = runs[-1]
+			runs[-1] = (start, length + size, count + 1)
+		else:
+			runs.append((offset, size, 1))
+	return runs
+
+
+def iter_samples(trak, source, prefetch=2, read_size=SAMPLE_READ_SIZE):
+	"""Iterate over the samples of a track, yielding (index, decode_time, data)
+	for each sample. The data is a memoryview of the sample bytes, and the decode
+	time is in the timescale of the track (or None if there is no "stts" atom).
+
+	Consecutive samples that are contiguous in the source are fetched with a
+	single read of up to read_size bytes. If prefetch is more than 0 and the
+	source has a file descriptor, up to that many reads are done ahead on a
+	background thread, and the source shouldn't be used elsewhere meanwhile.
+	"""
+	table = SampleTable(trak)
+	sizes = table.sample_sizes
+	if table.time_to_sample_atom is not None:
+		times = table.decode_times()
+	else:
+		times = [None] * len(sizes)
+
+	reads = contiguous_runs(table.sample_offsets(), sizes, read_size)
+	ranges = [(offset, size) for offset, size, _ in reads]
+	if prefetch > 0 and hasattr(source, "fileno"):
+		blocks = prefetch_ranges(source.fileno(), ranges, prefetch)
+	else:
+		blocks = read_ranges(source, ranges)
+
+	try:
+		sample = 0
+		for (offset, size, count), data in itertools.izip(reads, blocks):
+			if len(data) < size:
+				raise QuickTimeParseError("Unexpected end of file while reading samples", offset + len(data))
+
+			view = memoryview(data)
+			start = 0
+			for index in xrange(sample, sample + count):
+				end = start + sizes[index]
+				yield index, times[index], view[start:end]
+				start = end
+			sample += count
+	finally:
+		blocks.close()
+
+
+def read_ranges(source, ranges):
+	"""Read (offset, size) ranges from a stream, yielding the data of each range."""
+	for offset, size in ranges:
+		source.seek(offset)
+		yield source.read(size)
+
+
+def prefetch_ranges(fd, ranges, depth):
+	"""Read (offset, size) ranges from a file descriptor on a background thread,
+	keeping up to depth ranges ahead. Yields the data of each range."""
+	queue = Queue.Queue(depth)
+	stop = threading.Event()
+
+	def reader():
+		try:
+			for offset, size in ranges:
+				if stop.is_set():
+					break
+				queue.put(qtfile.pread(fd, size, offset))
+		except Exception, e:
+			queue.put(e)
+
+	thread = threading.Thread(target=reader)
+	thread.daemon = True
+	thread.start()
+
+	try:
+		for _ in ranges:
+			data = queue.get()
+			if isinstance(data, Exception):
+				raise data
+			yield data
+	finally:
+		# Make room in the queue, so the reader can see that it should stop.
+		stop.set()
+		try:
+			queue.get_nowait()
+		except Queue.Empty:
+			pass
+
+
+def mdat_header(payload_size):
+	"""Returns the header of an "mdat" atom for a payload of the given size,
+	using the extended size field if the atom is 4 GB or larger."""
+	if payload_size + 8 < 2**32:
+		return struct.pack(">L4s", payload_size + 8, "mdat")
+	return struct.pack(">L4sQ", 1, "mdat", payload_size + 16)
+
+
+def copy_range(source, output, offset, size):
+	"""Copy a range of bytes from source to the current position in output,
+	with reads and writes in large chunks."""
+	source.seek(offset)
+	while size > 0:
+		data = source.read(min(size, qtfile.COPY_CHUNK_SIZE))
+		if not data:
+			raise QuickTimeParseError("Unexpected end of file while copying samples", source.tell())
+		output.write(data)
+		size -= len(data)
+
+
+def extract_tracks(qt, source, output, handler_types=(), track_ids=(), checksum=None, progress=None):
+	"""Write a new movie with only the tracks selected by media handler type or
+	track ID. The source is the stream the movie was read from.
+
+	The "moov" atom of the movie is modified in place, and written with the chunk
+	offsets relocated to a single new "mdat" atom. Only the chunks referenced by
+	the selected tracks are copied, with adjacent chunks merged into larger range
+	copies. The output movie consists of the "ftyp" atom (if any), "moov" and "mdat".
+
+	The checksum and progress parameters work like in QuickTimeFile.write(),
+	and a manifest is returned if checksum is set.
+	"""
+	moov = find_moov(qt)
+	selected = find_tracks(moov, handler_types, track_ids)
+	if not selected:
+		raise ValueError("No tracks match handler types %s or track IDs %s" % (list(handler_types), list(track_ids)))
+
+	selected_ids = set([id(trak) for trak in selected])
+	moov[:] = [atom for atom in moov if atom.kind != "trak" or id(atom) in selected_ids]
+
+	# References to tracks that were left out would point at nothing.
+	kept_ids = set([track_id(trak) for trak in selected])
+	for trak in selected:
+		remove_track_references(trak, kept_ids)
+
+	tables = [SampleTable(trak) for trak in selected]
+	runs = coalesce([(offset, size) for table in tables for offset, size, _, _ in table.chunks()])
+	payload_size = sum([size for _, size in runs])
+
+	mdat = mdat_header(payload_size)
+	header_atoms = [atom for atom in qt if atom.kind == "ftyp"][:1] + [moov]
+
+	# Chunk offsets have to be 64-bit if the new media data extends beyond 4 GB.
+	data_start = sum([atom.size for atom in header_atoms]) + len(mdat)
+	if data_start + payload_size > 2**32:
+		for table in tables:
+			if table.chunk_offset_atom.kind == "stco":
+				table.chunk_offset_atom = promote_chunk_offsets(table.chunk_offset_atom)
+		data_start = sum([atom.size for atom in header_atoms]) + len(mdat)
+
+	# Relocate each chunk to its position in the new media data.
+	run_starts = [offset for offset, _ in runs]
+	run_targets = []
+	position = data_start
+	for _, size in runs:
+		run_targets.append(position)
+		position += size
+
+	for table in tables:
+		relocated = []
+		for offset in table.chunk_offsets:
+			run = bisect.bisect_right(run_starts, offset) - 1
+			relocated.append(run_targets[run] + offset - run_starts[run])
+		table.chunk_offset_atom["table"] = relocated
+
+	if progress is not None:
+		if not isinstance(progress, qtfile.ProgressMonitor):
+			progress = qtfile.ProgressMonitor(progress)
+		progress.start(data_start + payload_size)
+		output = qtfile.ProgressStream(output, progress)
+	elif not qtfile.is_seekable(output):
+		output = qtfile.SequentialStream(output)
+
+	if checksum is not None:
+		output = qtfile.ChecksumStream(output, checksum)
+
+	for atom in header_atoms:
+		if checksum is not None:
+			output.start_atom(atom.kind)
+		atom.write(output)
+		if checksum is not None:
+			output.finish_atom()
+
+	if checksum is not None:
+		output.start_atom("mdat")
+
+	output.write(mdat)
+
+	for offset, size in runs:
+		copy_range(source, output, offset, size)
+
+	if progress is not None:
+		progress.finish(output.tell())
+
+	if checksum is not None:
+		output.finish_atom()
+		return output.manifest()
+
+
+def remove_track_references(trak, track_ids):
+	"""Remove references from a track to tracks with IDs that are not in track_ids,
+	and any "tref" atoms left empty."""
+	for tref in trak.find("tref", recursive=False):
+		for reference in tref:
+			reference["track_ids"] = [i for i in reference["track_ids"] if i in track_ids]
+		tref[:] = [reference for reference in tref if reference["track_ids"]]
+	trak[:] = [atom for atom in trak if atom.kind != "tref" or len(atom)]
+
+
+def promote_chunk_offsets(stco):
+	"""Replace a 32-bit chunk offset atom with a 64-bit one in its parent."""
+	co64 = qtatoms.ChunkOffset64Atom("co64")
+	co64.fields.update(stco.fields)
+	co64.parent = stco.parent
+	siblings = stco.parent
+	for index, sibling in enumerate(siblings):
+		if sibling is stco:
+			siblings[index] = co64
+			break
+	return co64
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+
+import sys
+import json
+import logging
+import optparse
+
+import numpy
+
+import qtfile
+import qtatoms
+
+
+USAGE = """Usage: %prog [options] <movie ...>
+
+Validate the structure of QuickTime movies. Findings are printed as one JSON
+object per line, and the exit status is 1 if any movie has findings.
+"""
+
+# Maximum number of offending table entries listed in a single finding.
+MAX_ENTRIES = 100
+
+
+def validate(qt):
+	"""Validate the structure of a parsed QuickTimeFile. Returns a list of findings,
+	where each finding is a dict with the keys "check", "path", "offset" and "message".
+	Findings about table entries also have "count" and "entries" (the table indices,
+	up to MAX_ENTRIES of them)."""
+	findings = []
+	findings.extend(check_sizes(qt))
+	findings.extend(check_entry_counts(qt))
+
+	payloads = mdat_payloads(qt)
+	for stbl in qt.find("stbl"):
+		findings.extend(check_chunk_offsets(stbl, payloads))
+		findings.extend(check_sample_to_chunk(stbl))
+
+	return findings
+
+
+def finding(check, atom, message, entries=None):
+	"""Returns a finding for an atom."""
+	result = {"check": check,
+			  "path": atom.path,
+			  "offset": atom.source_offset,
+			  "message": message}
+	if entries is not None:
+		result["count"] = len(entries)
+		result["entries"] = [int(entry) for entry in entries[:MAX_ENTRIES]]
+	return result
+
+
+def walk(atoms):
+	"""Iterate over all atoms in a tree, depth first."""
+	for atom in atoms:
+		yield atom
+		for child in walk(atom):
+			yield child
+
+
+def mdat_payloads(qt):
+	"""Returns a sorted list of (start, end) offsets of all media data payloads."""
+	payloads = []
+	for atom in qt:
+		if atom.kind == "mdat" and atom.source_offset is not None:
+			header_size = 16 if atom.extended_header else 8
+			payloads.append((atom.source_offset + header_size, atom.source_offset + atom.source_size))
+	return sorted(payloads)
+
+
+def check_sizes(qt):
+	"""Check that each parsed atom can be decoded, and that its size matches the
+	size it was read with."""
+	findings = []
+	for atom in walk(qt):
+		if isinstance(atom, qtfile.PassthroughAtom) or atom.source_size is None:
+			continue
+		try:
+			decode(atom)
+		except qtfile.QuickTimeParseError, e:
+			findings.append(finding("parse", atom, "Could not parse data: %s" % e))
+			continue
+		if atom.source_size != atom.size:
+			findings.append(finding("size", atom, "Size mismatch [%s->%s]" % (atom.source_size, atom.size)))
+	return findings
+
+
+def check_entry_counts(qt):
+	"""Check that the entry counts stored in atoms match the parsed tables."""
+	findings = []
+	for atom in walk(qt):
+		if not decodes(atom):
+			continue
+
+		if isinstance(atom, qtatoms.TableAtom):
+			header = atom.header_fields()
+			if isinstance(atom, qtatoms.SampleSizeAtom) and header["sample_size"]:
+				# All samples have the same size, so there's no table.
+				continue
+			expected, actual = header["num_table_entries"], atom.row_count()
+		elif atom.kind == "keys":
+			expected, actual = atom["entry_count"], len(atom["keys"])
+		elif atom.kind == "stsd":
+			expected, actual = atom["num_descriptions"], len(atom)
+		else:
+			continue
+
+		if expected != actual:
+			findings.append(finding("entry-count", atom, "Entry count mismatch [%d->%d]" % (expected, actual)))
+
+	return findings
+
+
+def check_chunk_offsets(stbl, payloads):
+	"""Check that all chunk offsets in a sample table point inside a media data payload."""
+	findings = []
+	for stco in stbl.find(["stco", "co64"], recursive=False):
+		if not decodes(stco):
+			continue
+		invalid = outside_ranges(table_columns(stco)[0], payloads)
+		if len(invalid):
+			findings.append(finding("chunk-offset", stco, "Chunk offsets outside of media data", invalid))
+	return findings
+
+
+def check_sample_to_chunk(stbl):
+	"""Check that the sample-to-chunk table is consistent with the chunk offset table
+	and the sample descriptions."""
+	stsc = first_parsed(stbl, ["stsc"])
+	stco = first_parsed(stbl, ["stco", "co64"])
+	stsd = first_parsed(stbl, ["stsd"])
+	if stsc is None:
+		return []
+
+	first_chunks, samples, descriptions = table_columns(stsc)
+	if not len(first_chunks):
+		return []
+
+	unordered = numpy.flatnonzero(first_chunks[1:] <= first_chunks[:-1]) + 1
+	if first_chunks[0] != 1:
+		unordered = numpy.concatenate([[0], unordered])
+	empty = numpy.flatnonzero(samples == 0)
+
+	chunk_count = None
+	out_of_range = []
+	if stco is not None:
+		chunk_count = stco.row_count()
+		out_of_range = numpy.flatnonzero(first_chunks > chunk_count)
+
+	bad_descriptions = []
+	if stsd is not None:
+		bad_descriptions = numpy.flatnonzero((descriptions < 1) | (descriptions > len(stsd)))
+
+	findings = []
+	if len(unordered):
+		findings.append(finding("sample-to-chunk", stsc, "First chunks not starting at 1 and increasing", unordered))
+	if len(out_of_range):
+		findings.append(finding("sample-to-chunk", stsc, "First chunks beyond chunk count (%d)" % chunk_count, out_of_range))
+	if len(empty):
+		findings.append(finding("sample-to-chunk", stsc, "Chunks without samples", empty))
+	if len(bad_descriptions):
+		findings.append(finding("sample-to-chunk", stsc, "Unknown sample descriptions", bad_descriptions))
+	return findings
+
+
+def first_parsed(atom, types):
+	"""Returns the first parsed (non-passthrough) child of specific types, or None."""
+	for child in atom.find(types, recursive=False):
+		if decodes(child):
+			return child
+	return None
+
+
+def decodes(atom):
+	"""Returns True if an atom is parsed and can be decoded with decode(). Atoms
+	that can't be decoded are reported by check_sizes()."""
+	if isinstance(atom, qtfile.PassthroughAtom):
+		return False
+	try:
+		decode(atom)
+	except qtfile.QuickTimeParseError:
+		return False
+	return True
+
+
+def decode(atom):
+	"""Decode the fields of an atom. Tables are only checked, as they are read
+	straight from their raw data by table_columns(). Raises QuickTimeParseError
+	if the atom can't be decoded."""
+	if isinstance(atom, qtatoms.TableAtom):
+		atom.header_fields()
+		atom.row_count()
+	else:
+		atom.decode()
+
+
+def table_columns(atom):
+	"""Returns the table of a TableAtom as a list of numpy arrays, one for each
+	column of table_row_format."""
+	format = atom.table_row_format
+	byte_order = format[:1] if format[:1] in "@=<>!" else ""
+	dtype = numpy.dtype([("c%d" % i, byte_order + code) for i, code in enumerate(format[len(byte_order):])])
+	rows = numpy.frombuffer(atom.packed_table(), dtype=dtype)
+	return [rows[name] for name in dtype.names]
+
+
+def outside_ranges(values, ranges):
+	"""Returns the indices of all values in a numpy array that are not inside any of
+	the sorted (start, end) ranges, as a numpy array."""
+	if not ranges:
+		return numpy.arange(len(values))
+
+	starts = numpy.array([start for start, _ in ranges], dtype=numpy.uint64)
+	ends = numpy.array([end for _, end in ranges], dtype=numpy.uint64)
+	values = values.astype(numpy.uint64)
+	index = numpy.searchsorted(starts, values, side="right") - 1
+	inside = (index >= 0) & (values < ends[index.clip(0)])
+	return numpy.flatnonzero(~inside)
+
+
+def main(argv):
+	parser = optparse.OptionParser(usage=USAGE)
+	parser.add_option("-D", "--debug", action="store_true", help="Enable debugging output")
+
+	opts, args = parser.parse_args(argv)
+
+	if opts.debug:
+		logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(message)s", level=logging.DEBUG)
+	else:
+		logging.basicConfig(format="%(asctime)s | %(levelname)-8s | %(message)s", level=logging.ERROR)
+
+	status = 0
+	for qt_path in args[1:]:
+		qt = qtfile.QuickTimeFile(qt_path, atom_modules=[qtatoms])
+		for f in validate(qt):
+			f["file"] = qt_path
+			print json.dumps(f, encoding="latin-1", sort_keys=True)
+			status = 1
+
+	return status
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))